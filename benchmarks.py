@@ -0,0 +1,461 @@
+#!/usr/bin/python
+
+# Micro-benchmarks for the keychain parser.
+#
+# Run against a keychain file:
+#   python benchmarks.py path/to/login.keychain
+# Benchmarks that don't need a keychain (LV decoding, time parsing, record memory) also run without one.
+#
+# Each benchmark reports a rate for the code path it measures. Where a faster
+# path replaced an older one, both are timed on the same records and their
+# results compared, so a benchmark run doubles as a consistency check.
+
+import argparse
+from datetime import datetime, timedelta
+import struct
+import sys
+import time
+
+from chainbreaker import Chainbreaker
+from schema import *
+from schema import _APPL_DB_HEADER, _GENERIC_PW_HEADER, _INTERNET_PW_HEADER, _APPLE_SHARE_HEADER, \
+    _X509_CERT_HEADER, _SECKEY_HEADER, _GENERIC_PW_ATTRIBUTES, _INTERNET_PW_ATTRIBUTES, _APPLE_SHARE_ATTRIBUTES, \
+    _X509_CERT_ATTRIBUTES, _SECKEY_ATTRIBUTES, _KEYCHAIN_TIME, _INT, _FOUR_CHAR_CODE, _SSGP, _read_lv
+
+# (name, table type, header class, attribute layout, compiled decoder)
+RECORD_TYPES = [
+    ('generic password', CSSM_DL_DB_RECORD_GENERIC_PASSWORD, _GENERIC_PW_HEADER, _GENERIC_PW_ATTRIBUTES,
+     Chainbreaker.GENERIC_PW_DECODER),
+    ('internet password', CSSM_DL_DB_RECORD_INTERNET_PASSWORD, _INTERNET_PW_HEADER, _INTERNET_PW_ATTRIBUTES,
+     Chainbreaker.INTERNET_PW_DECODER),
+    ('appleshare password', CSSM_DL_DB_RECORD_APPLESHARE_PASSWORD, _APPLE_SHARE_HEADER, _APPLE_SHARE_ATTRIBUTES,
+     Chainbreaker.APPLE_SHARE_DECODER),
+    ('x509 certificate', CSSM_DL_DB_RECORD_X509_CERTIFICATE, _X509_CERT_HEADER, _X509_CERT_ATTRIBUTES,
+     Chainbreaker.X509_CERT_DECODER),
+    ('public key', CSSM_DL_DB_RECORD_PUBLIC_KEY, _SECKEY_HEADER, _SECKEY_ATTRIBUTES, Chainbreaker.SECKEY_DECODER),
+    ('private key', CSSM_DL_DB_RECORD_PRIVATE_KEY, _SECKEY_HEADER, _SECKEY_ATTRIBUTES, Chainbreaker.SECKEY_DECODER),
+]
+
+
+# Calls fn repeatedly for at least min_time seconds, returns calls per second.
+def _rate(fn, min_time):
+    calls = 0
+    start = time.time()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            return calls / elapsed
+
+
+# LV attribute lengths found in real keychains: short labels, account names, service names, 20 byte hashes and
+# key identifiers, URLs and paths, DER encoded certificate subjects and issuers.
+LV_SIZES = [4, 13, 20, 37, 64, 150, 400]
+
+
+# LV decoding as done before lengths were aligned with bit ops and Structs were cached: a new Struct per value.
+def _read_lv_per_call_struct(buffer, base_addr, pcol):
+    if pcol <= 0:
+        return ''
+
+    str_length = struct.unpack_from('>I', buffer, base_addr + pcol)[0]
+    if (str_length % 4) == 0:
+        real_str_len = (str_length // 4) * 4
+    else:
+        real_str_len = ((str_length // 4) + 1) * 4
+
+    try:
+        return struct.Struct('>' + str(real_str_len) + 's').unpack_from(buffer, base_addr + pcol + 4)[0].strip('\x00')
+    except struct.error:
+        return ''
+
+
+# Values decoded per second by _read_lv (which the record decoders call) for each size in LV_SIZES, against
+# the per call Struct decoding it replaced. Uses a buffer of 1000 padded attributes of each size.
+def bench_lv(min_time=1.0):
+    results = []
+    for size in LV_SIZES:
+        value = ''.join(chr(ord('a') + i % 26) for i in range(size))
+        attribute = struct.pack('>I', size) + value + '\x00' * (-size & 3)
+        # Attributes are never at offset 0 of a record, which holds the record size
+        buffer = '\x00' * 4 + attribute * 1000
+        offsets = range(4, len(buffer), len(attribute))
+
+        if _read_lv(buffer, 0, offsets[0]) != value or _read_lv_per_call_struct(buffer, 0, offsets[0]) != value:
+            raise AssertionError("LV decoding of a %d byte value is wrong" % size)
+
+        def per_call_struct():
+            for pcol in offsets:
+                _read_lv_per_call_struct(buffer, 0, pcol)
+
+        def sliced():
+            for pcol in offsets:
+                _read_lv(buffer, 0, pcol)
+
+        results.append((size, _rate(per_call_struct, min_time) * len(offsets), _rate(sliced, min_time) * len(offsets)))
+
+    return results
+
+
+# Times parsed per second by _KEYCHAIN_TIME.parse against datetime.strptime, for 1000 timestamps that are
+# all distinct (parse clears its cache on every pass) and 1000 drawn from 20 distinct ones.
+def bench_keychain_time(min_time=1.0):
+    start = datetime(2020, 11, 12, 15, 0, 0)
+    distinct = [(start + timedelta(seconds=67 * i)).strftime('%Y%m%d%H%M%SZ') + '\x00' for i in range(1000)]
+    repeated = [distinct[i % 20] for i in range(1000)]
+
+    results = []
+    for name, values in (('distinct', distinct), ('repeated', repeated)):
+        for raw in values:
+            if _KEYCHAIN_TIME.parse(raw) != datetime.strptime(raw.strip('\x00'), _KEYCHAIN_TIME.STRPTIME_FORMAT):
+                raise AssertionError("Keychain time %r parsed wrong" % raw)
+
+        def strptime():
+            for raw in values:
+                datetime.strptime(raw.strip('\x00'), _KEYCHAIN_TIME.STRPTIME_FORMAT)
+
+        def parse():
+            if values is distinct:
+                _KEYCHAIN_TIME.CACHE.clear()
+            for raw in values:
+                _KEYCHAIN_TIME.parse(raw)
+
+        results.append((name, _rate(strptime, min_time) * len(values), _rate(parse, min_time) * len(values)))
+
+    return results
+
+
+class _DictRecord(object):
+    pass
+
+
+# A copy of a slotted object with its attributes, and the logger records used to hold, in an instance dict, as
+# records were stored before they had __slots__.
+def _dict_backed(obj):
+    copy = _DictRecord()
+    copy.logger = Chainbreaker.KeychainRecord.logger
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, '__slots__', ()):
+            setattr(copy, name, getattr(obj, name))
+    return copy
+
+
+# Bytes taken by an object and its instance dict, not counting the attribute values, which are the same either way
+def _instance_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+# Bytes per record, excluding attribute values, for count synthetic records of each kind, as stored in
+# __slots__ and in instance dicts. Password records include their SSGP header.
+def bench_record_memory(count=100000):
+    ssgp = 'ssgp' + '\x01' * 24 + '\x02' * 16
+    created = datetime(2020, 11, 12, 15, 0, 0)
+    kinds = [
+        ('generic password', lambda: Chainbreaker.GenericPasswordRecord(
+            created=created, last_modified=created, description='application password', creator='aapl',
+            type='note', print_name='example.com', alias='', account='user', service='example.com',
+            ssgp=_SSGP(ssgp), dbkey='\x00' * 24)),
+        ('internet password', lambda: Chainbreaker.InternetPasswordRecord(
+            created=created, last_modified=created, description='Web form password', comment='', creator='',
+            type='', print_name='example.com', alias='', protected='', account='user', security_domain='',
+            server='example.com', protocol_type='htps', auth_type='form', port=0, path='/',
+            ssgp=_SSGP(ssgp), dbkey='\x00' * 24)),
+        ('private key', lambda: Chainbreaker.PrivateKeyRecord(
+            print_name='example key', label='\x03' * 20, key_class='CSSM_KEYCLASS_PRIVATE_KEY', private=1,
+            key_type='CSSM_ALGID_RSA', key_size=2048, effective_key_size=2048, extracted=1,
+            cssm_type='CSSM_ALGID_RSA', key_name='\x03' * 20, private_key='\x04' * 1200, iv='\x05' * 8,
+            key='\x06' * 24)),
+    ]
+
+    def record_size(record):
+        size = _instance_size(record)
+        if getattr(record, 'SSGP', None) is not None:
+            size += _instance_size(record.SSGP)
+        return size
+
+    results = []
+    for name, make in kinds:
+        records = [make() for _ in range(count)]
+        slotted = sum(record_size(record) for record in records)
+
+        dict_backed = 0
+        for record in records:
+            copy = _dict_backed(record)
+            if getattr(record, 'SSGP', None) is not None:
+                copy.SSGP = _dict_backed(record.SSGP)
+            dict_backed += _instance_size(copy) + (_instance_size(copy.SSGP) if hasattr(copy, 'SSGP') else 0)
+
+        results.append((name, float(dict_backed) / count, float(slotted) / count))
+
+    return results
+
+
+# Addresses of every record in a table, or [] if the keychain has no such table
+def _record_addresses(keychain, table_type):
+    try:
+        table_offset = keychain._get_table_offset(table_type)
+    except KeyError:
+        return []
+
+    return [_APPL_DB_HEADER.STRUCT.size + table_offset + record_offset
+            for record_offset in keychain._get_table(table_offset)[1]]
+
+
+class _PerFieldInt(object):
+    def __init__(self, buffer):
+        self.Value = _INT.STRUCT.unpack(buffer)[0]
+
+
+class _PerFieldFourCharCode(object):
+    def __init__(self, buffer):
+        self.Value = _FOUR_CHAR_CODE.STRUCT.unpack(buffer)[0]
+
+
+class _PerFieldLV(object):
+    def __init__(self, buffer, size):
+        self.Value = struct.Struct('>' + str(size) + 's').unpack(buffer)[0].strip('\x00')
+
+
+class _PerFieldTime(object):
+    def __init__(self, buffer):
+        self.Value = _KEYCHAIN_TIME.STRUCT.unpack(buffer)[0].strip('\x00')
+        try:
+            self.Time = datetime.strptime(self.Value, _KEYCHAIN_TIME.STRPTIME_FORMAT)
+        except ValueError:
+            # The old decoder raised here; the value is kept so both paths can be compared
+            self.Time = self.Value
+
+
+# The per-attribute decoding the compiled decoders replaced: the record header and every attribute are sliced
+# out of the buffer and wrapped in an object of their own, with a new Struct for each LV value and strptime
+# for each time.
+def _decode_per_field(keychain, header_class, layout, base_addr):
+    buffer = keychain.kc_buffer
+
+    def get_int(pcol):
+        return _PerFieldInt(buffer[base_addr + pcol:base_addr + pcol + 4]).Value if pcol > 0 else 0
+
+    def get_four_char_code(pcol):
+        return _PerFieldFourCharCode(buffer[base_addr + pcol:base_addr + pcol + 4]).Value if pcol > 0 else ''
+
+    def get_time(pcol):
+        if pcol <= 0:
+            return ''
+        return _PerFieldTime(buffer[base_addr + pcol:base_addr + pcol + _KEYCHAIN_TIME.STRUCT.size]).Time
+
+    def get_lv(pcol):
+        if pcol <= 0:
+            return ''
+
+        str_length = _PerFieldInt(buffer[base_addr + pcol:base_addr + pcol + 4]).Value
+        if (str_length % 4) == 0:
+            real_str_len = (str_length // 4) * 4
+        else:
+            real_str_len = ((str_length // 4) + 1) * 4
+
+        try:
+            return _PerFieldLV(buffer[base_addr + pcol + 4:base_addr + pcol + 4 + real_str_len], real_str_len).Value
+        except struct.error:
+            return ''
+
+    getters = {
+        ATTR_INT: get_int,
+        ATTR_FOUR_CHAR_CODE: get_four_char_code,
+        ATTR_TIME: get_time,
+        ATTR_LV: get_lv,
+    }
+
+    record_meta = header_class(buffer[base_addr:base_addr + header_class.STRUCT.size])
+    return dict((name, getters[attr_type](getattr(record_meta, field) & 0xFFFFFFFE))
+                for name, field, attr_type in layout)
+
+
+# Records per second decoding each record type's attributes, per field and with the compiled decoder.
+def bench_record_decoders(keychain, min_time=1.0):
+    results = []
+    for name, table_type, header_class, layout, decoder in RECORD_TYPES:
+        addresses = _record_addresses(keychain, table_type)
+        if not addresses:
+            continue
+
+        for base_addr in addresses:
+            if decoder(keychain.kc_buffer, base_addr)[1] != _decode_per_field(keychain, header_class, layout,
+                                                                              base_addr):
+                raise AssertionError("Compiled %s decoder disagrees with per field decoding" % name)
+
+        def per_field():
+            for base_addr in addresses:
+                _decode_per_field(keychain, header_class, layout, base_addr)
+
+        def compiled():
+            for base_addr in addresses:
+                decoder(keychain.kc_buffer, base_addr)
+
+        results.append((name, len(addresses), _rate(per_field, min_time) * len(addresses),
+                        _rate(compiled, min_time) * len(addresses)))
+
+    return results
+
+
+# Dumps per second of the password and certificate tables reading only the attributes a filter on service
+# and account (or print name) would look at, with eagerly and lazily decoded records.
+def bench_lazy_filter(keychain, min_time=1.0):
+    dumps = [
+        ('generic password', keychain.dump_generic_passwords, ('Service', 'Account')),
+        ('internet password', keychain.dump_internet_passwords, ('Server', 'Account')),
+        ('x509 certificate', keychain.dump_x509_certificates, ('PrintName',)),
+    ]
+
+    lazy_records = keychain.lazy_records
+    results = []
+    try:
+        for name, dump, attributes in dumps:
+            def filter_records():
+                return [[getattr(record, attribute) for attribute in attributes] for record in dump()]
+
+            keychain.lazy_records = False
+            eager_values = filter_records()
+            if not eager_values:
+                continue
+            eager = _rate(filter_records, min_time)
+
+            keychain.lazy_records = True
+            if filter_records() != eager_values:
+                raise AssertionError("Lazy %s records disagree with eagerly decoded ones" % name)
+            lazy = _rate(filter_records, min_time)
+
+            results.append((name, len(eager_values), eager, lazy))
+    finally:
+        keychain.lazy_records = lazy_records
+
+    return results
+
+
+# Dumps per second of the generic passwords whose service contains "vpn", filtering after decoding every
+# record and with the filter pushed down to the raw records.
+def bench_filter_pushdown(keychain, min_time=1.0):
+    def filter_decoded():
+        return [record for record in keychain.dump_generic_passwords() if 'vpn' in record.Service.lower()]
+
+    def pushdown():
+        return keychain.dump_generic_passwords('service~=vpn')
+
+    matches = [str(record) for record in filter_decoded()]
+    if [str(record) for record in pushdown()] != matches:
+        raise AssertionError("Filter pushdown disagrees with filtering decoded records")
+
+    return len(keychain.dump_generic_passwords()), len(matches), _rate(filter_decoded, min_time), \
+        _rate(pushdown, min_time)
+
+
+# Lookups per second of one generic password by service and account, searching a fresh dump each time and
+# with find_generic_password once its indexes are built.
+def bench_find(keychain, min_time=1.0):
+    records = keychain.dump_generic_passwords()
+    if not records:
+        return None
+    service, account = records[-1].Service, records[-1].Account
+
+    def linear():
+        for record in keychain.dump_generic_passwords():
+            if record.Service == service and record.Account == account:
+                return record
+
+    def indexed():
+        return keychain.find_generic_password(service=service, account=account)
+
+    if str(linear()) != str(indexed()):
+        raise AssertionError("find_generic_password disagrees with a linear search")
+
+    return len(records), _rate(linear, min_time), _rate(indexed, min_time)
+
+
+# First lookup of a value on each attribute a table has an on-disk index on, by reading the attribute from every
+# record and by searching the keychain's own index. Yields nothing for keychains without table indexes.
+def bench_disk_indexes(keychain, min_time=1.0):
+    for name, table_type, header_class, layout, decode in RECORD_TYPES:
+        disk_indexes = keychain._get_disk_indexes(table_type, header_class, layout)
+        for attribute in sorted(disk_indexes):
+            index_addr, index, read_key, read_attribute = disk_indexes[attribute]
+            value = read_key(keychain.kc_buffer, index_addr, index.KeyOffsets[-1])
+
+            def scan():
+                keychain._indexes.pop((table_type, attribute), None)
+                return sorted(keychain._get_index(table_type, header_class, layout, attribute)[value])
+
+            def disk():
+                return sorted(keychain._search_disk_index(table_type, disk_indexes[attribute], value))
+
+            if scan() != disk():
+                raise AssertionError("The %s index on %s disagrees with a scan" % (name, attribute))
+
+            yield "%s %s" % (name, attribute), len(keychain._get_table_from_type(table_type)[1]), \
+                _rate(scan, min_time), _rate(disk, min_time)
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Benchmark the Chainbreaker keychain parser')
+    arguments.add_argument('keychain', nargs='?',
+                           help='Location of a keychain file to run the record benchmarks against')
+    arguments.add_argument('--min-time', type=float, default=1.0, help='Seconds to run each measurement for')
+    arguments.add_argument('--records', type=int, default=100000,
+                           help='Number of synthetic records used to measure memory')
+    args = arguments.parse_args()
+
+    print("LV decoding (values/second)")
+    print("%-20s %12s %12s %8s" % ('length', 'Struct/call', 'slice', 'speedup'))
+    for size, before, after in bench_lv(args.min_time):
+        print("%-20d %12.0f %12.0f %7.1fx" % (size, before, after, after / before))
+
+    print("")
+    print("Keychain time parsing (times/second)")
+    print("%-20s %12s %12s %8s" % ('timestamps', 'strptime', 'parse', 'speedup'))
+    for name, before, after in bench_keychain_time(args.min_time):
+        print("%-20s %12.0f %12.0f %7.1fx" % (name, before, after, after / before))
+
+    print("")
+    print("Record memory (bytes/record over %d records, excluding attribute values)" % args.records)
+    print("%-20s %12s %12s %8s" % ('type', 'dict', 'slots', 'saving'))
+    for name, before, after in bench_record_memory(args.records):
+        print("%-20s %12.0f %12.0f %7.0f%%" % (name, before, after, 100 * (1 - after / before)))
+
+    if not args.keychain:
+        exit(0)
+
+    print("")
+    with Chainbreaker(args.keychain) as keychain:
+        print("Record decoding (records/second)")
+        print("%-20s %8s %12s %12s %8s" % ('type', 'records', 'per field', 'compiled', 'speedup'))
+        for name, count, before, after in bench_record_decoders(keychain, args.min_time):
+            print("%-20s %8d %12.0f %12.0f %7.1fx" % (name, count, before, after, after / before))
+
+        print("")
+        print("Filtering on service and account (dumps/second)")
+        print("%-20s %8s %12s %12s %8s" % ('type', 'records', 'eager', 'lazy', 'speedup'))
+        for name, count, before, after in bench_lazy_filter(keychain, args.min_time):
+            print("%-20s %8d %12.0f %12.0f %7.1fx" % (name, count, before, after, after / before))
+
+        print("")
+        print("Generic passwords with service~=vpn (dumps/second)")
+        print("%-20s %8s %12s %12s %8s" % ('records', 'matches', 'decoded', 'pushdown', 'speedup'))
+        count, matches, before, after = bench_filter_pushdown(keychain, args.min_time)
+        print("%-20d %8d %12.0f %12.0f %7.1fx" % (count, matches, before, after, after / before))
+
+        find = bench_find(keychain, args.min_time)
+        if find:
+            print("")
+            print("Generic password lookup by service and account (lookups/second)")
+            print("%-20s %12s %12s %8s" % ('records', 'linear', 'indexed', 'speedup'))
+            print("%-20d %12.0f %12.0f %7.1fx" % (find[0], find[1], find[2], find[2] / find[1]))
+
+        disk_indexes = list(bench_disk_indexes(keychain, args.min_time))
+        if disk_indexes:
+            print("")
+            print("First lookup of an attribute value (lookups/second)")
+            print("%-30s %8s %12s %12s %8s" % ('attribute', 'records', 'scan', 'on-disk', 'speedup'))
+            for name, count, before, after in disk_indexes:
+                print("%-30s %8d %12.0f %12.0f %7.1fx" % (name, count, before, after, after / before))
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+
+# Bitsliced Triple DES, for testing many candidate keys against one ciphertext.
+#
+# Each bit of the DES state is a row of a NumPy array holding that bit for every
+# candidate key, so the permutations are just row reindexing and every round
+# runs over all candidates at once. The S-boxes are vectorized table lookups on
+# the 6-bit groups. Only the decryption of a single CBC block is implemented,
+# which is all that is needed to check a key against padded ciphertext.
+#
+# NumPy is optional. Without it the scalar pyDes engine is used instead.
+
+import os
+import time
+
+from pyDes import DES, TripleDES, CBC
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BLOCKSIZE = 8
+
+# Candidates decrypted together; bounds the memory used by the subkey arrays
+BATCH_SIZE = 4096
+
+# Index tables derived from the pyDes permutations, built on first use
+_tables = None
+
+
+def _des_table(name):
+    return getattr(DES, '_DES__' + name)
+
+
+def _build_tables():
+    pc1 = _des_table('pc1')
+    pc2 = _des_table('pc2')
+
+    # For each round, the key bit that ends up in each of the 48 subkey bits
+    subkeys = []
+    c, d = pc1[:28], pc1[28:]
+    for rotations in _des_table('left_rotations'):
+        c = c[rotations:] + c[:rotations]
+        d = d[rotations:] + d[:rotations]
+        subkeys.append([(c + d)[src] for src in pc2])
+
+    # S-box output bits, indexed [sbox][bit][6-bit group], the group read most significant bit first
+    sbox_bits = numpy.zeros((8, 4, 64), dtype=numpy.uint8)
+    for j, sbox in enumerate(_des_table('sbox')):
+        for six in range(64):
+            v = sbox[(six & 0x20) | ((six & 1) << 4) | ((six >> 1) & 0xf)]
+            for bit in range(4):
+                sbox_bits[j, bit, six] = (v >> (3 - bit)) & 1
+
+    # P picks bit (src & 3) of S-box (src >> 2), so P and the S-box lookup fold into one gather
+    p = _des_table('p')
+    p_sbox = numpy.array([src >> 2 for src in p])
+
+    return {
+        'subkeys': numpy.array(subkeys),
+        'expansion': numpy.array(_des_table('expansion_table')),
+        'ip': numpy.array(_des_table('ip')),
+        'fp': numpy.array(_des_table('fp')),
+        'sbox': sbox_bits.ravel(),
+        'p_sbox': p_sbox,
+        'p_offset': numpy.array([((src >> 2) * 4 + (src & 3)) * 64 for src in p])[:, numpy.newaxis],
+        'group_weights': numpy.array([32, 16, 8, 4, 2, 1], dtype=numpy.uint8)[:, numpy.newaxis],
+    }
+
+
+# Runs the 16 DES rounds over bit planes l and r (32 rows each) with subkeys k, an array of shape
+# (16, 48, candidates). Returns the final halves without the last swap.
+def _des_rounds(l, r, k, decrypt):
+    t = _tables
+    expansion, sbox, p_sbox, p_offset = t['expansion'], t['sbox'], t['p_sbox'], t['p_offset']
+    weights = t['group_weights']
+
+    for i in (range(15, -1, -1) if decrypt else range(16)):
+        x = r[expansion] ^ k[i]
+        six = (x.reshape(8, 6, -1) * weights).sum(axis=1, dtype=numpy.uint8)
+        l, r = r, l ^ numpy.take(sbox, six[p_sbox] + p_offset)
+
+    return l, r
+
+
+def _bits(data):
+    return numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8))
+
+
+# Decrypt block under each key in candidates (24 byte keys) and xor with chain, returning the plaintext as
+# an array of shape (8, candidates), one row per byte.
+def _bitsliced_decrypt(candidates, chain, block):
+    global _tables
+    if _tables is None:
+        _tables = _build_tables()
+
+    keys = numpy.frombuffer(b''.join(candidates), dtype=numpy.uint8).reshape(len(candidates), 24)
+    key_bits = numpy.ascontiguousarray(numpy.unpackbits(keys, axis=1).T)
+    subkeys = _tables['subkeys']
+
+    # The ciphertext is the same for every key, so the state starts out as one broadcast column
+    state = _bits(block)[_tables['ip']][:, numpy.newaxis]
+    l, r = state[:32], state[32:]
+
+    # EDE decryption: decrypt with key 3, encrypt with key 2, decrypt with key 1. FP followed by IP between
+    # the stages cancels out, leaving only the swap.
+    for des_key, decrypt in ((2, True), (1, False), (0, True)):
+        l, r = _des_rounds(l, r, key_bits[des_key * 64 + subkeys], decrypt)
+        l, r = r, l
+
+    plain = numpy.concatenate((l, r))[_tables['fp']] ^ _bits(chain)[:, numpy.newaxis]
+    return numpy.packbits(plain, axis=0)
+
+
+def _bitsliced_padding_mask(candidates, chain, block):
+    plain = _bitsliced_decrypt(candidates, chain, block)
+
+    pad = plain[BLOCKSIZE - 1]
+    valid = (pad >= 1) & (pad <= BLOCKSIZE)
+    for i in range(1, BLOCKSIZE):
+        valid &= (plain[BLOCKSIZE - 1 - i] == pad) | (pad <= i)
+
+    return valid.tolist()
+
+
+def _has_valid_padding(plain):
+    pad = ord(plain[-1:])
+    if pad == 0 or pad > BLOCKSIZE:
+        return False
+    return plain[-pad:] == plain[-1:] * pad
+
+
+def _scalar_padding_mask(candidates, chain, block):
+    return [_has_valid_padding(TripleDES(key, CBC).decrypt(block, IV=chain)) for key in candidates]
+
+
+# Decrypts one CBC block (block, chained from the previous ciphertext block or IV chain) under every
+# candidate 3DES key, and returns a list with True for each key whose plaintext is correctly padded.
+# About one wrong key in 256 also passes, so a True still has to be confirmed with a full decrypt.
+def padding_mask(candidates, chain, block, use_numpy=None):
+    if len(block) != BLOCKSIZE or len(chain) != BLOCKSIZE:
+        raise ValueError("Block and chain must be %d bytes long" % BLOCKSIZE)
+
+    # DES-EDE2 keys use key 1 as key 3
+    candidates = [key + key[:8] if len(key) == 16 else key for key in candidates]
+    for key in candidates:
+        if len(key) != 24:
+            raise ValueError("Invalid triple DES key size. Key must be either 16 or 24 bytes long")
+
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        raise ValueError("NumPy is not installed")
+
+    if not use_numpy:
+        return _scalar_padding_mask(candidates, chain, block)
+
+    mask = []
+    for start in range(0, len(candidates), BATCH_SIZE):
+        mask.extend(_bitsliced_padding_mask(candidates[start:start + BATCH_SIZE], chain, block))
+    return mask
+
+
+# Times padding_mask over count random keys with each available engine. Returns {engine: keys/second}.
+def benchmark(count=BATCH_SIZE):
+    candidates = [os.urandom(24) for _ in range(count)]
+    chain, block = os.urandom(BLOCKSIZE), os.urandom(BLOCKSIZE)
+
+    engines = [('scalar', False)]
+    if numpy is not None:
+        engines.append(('bitsliced', True))
+
+    results = {}
+    masks = []
+    for name, use_numpy in engines:
+        start = time.time()
+        masks.append(padding_mask(candidates, chain, block, use_numpy=use_numpy))
+        results[name] = count / (time.time() - start)
+
+    if masks.count(masks[0]) != len(masks):
+        raise AssertionError("Bitsliced and scalar engines disagree")
+
+    return results
+
+
+if __name__ == '__main__':
+    if numpy is None:
+        print("NumPy is not installed, only the scalar engine is available")
+    for engine, rate in sorted(benchmark().items()):
+        print("%-10s %10.0f keys/second" % (engine, rate))
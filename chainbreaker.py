@@ -20,15 +20,20 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 #
 import struct
-from pbkdf2 import PBKDF2
 from schema import *
 from schema import _APPL_DB_HEADER, _APPL_DB_SCHEMA, _TABLE_HEADER, _DB_BLOB, _GENERIC_PW_HEADER, \
     _KEY_BLOB_REC_HEADER, _KEY_BLOB, _SSGP, _INTERNET_PW_HEADER, _APPLE_SHARE_HEADER, _X509_CERT_HEADER, _SECKEY_HEADER, \
-    _UNLOCK_BLOB, _KEYCHAIN_TIME, _INT, _FOUR_CHAR_CODE, _LV, _TABLE_ID, _RECORD_OFFSET
-from pyDes import TripleDES, CBC
+    _UNLOCK_BLOB, _INT, _TABLE_ID, _TABLE_INDEX, _GENERIC_PW_ATTRIBUTES, _INTERNET_PW_ATTRIBUTES, \
+    _APPLE_SHARE_ATTRIBUTES, _X509_CERT_ATTRIBUTES, _SECKEY_ATTRIBUTES
+from crypto_backend import select_backend, backend_names, BuiltinCipher, AUTO
+from bitslice import padding_mask
+from record_filter import RecordFilter
 from binascii import unhexlify, hexlify
 import logging
 import base64
+import mmap
+import os
+import stat
 import string
 import uuid
 
@@ -40,7 +45,28 @@ class Chainbreaker(object):
     MAGIC_CMS_IV = unhexlify('4adda22c79e82105')
     KEYCHAIN_LOCKED_SIGNATURE = '[Invalid Password / Keychain Locked]'
 
-    def __init__(self, filepath, unlock_password=None, unlock_key=None, unlock_file=None):
+    # Expanded 3DES key schedules used by the builtin pyDes backend
+    key_schedule_cache = BuiltinCipher.key_schedule_cache
+
+    # Active CryptoBackend, chosen on first use unless set_crypto_backend() is called beforehand
+    crypto_backend = None
+
+    # Outcome of the tail block padding check done by _kcdecrypt(..., verify=True)
+    verify_accepted = 0
+    verify_rejected = 0
+
+    # Attribute lookups answered from the keychain's own table indexes, and those that had to scan the table
+    disk_index_lookups = 0
+    scan_lookups = 0
+
+    # Record decoders, built from the attribute layouts in schema.py
+    GENERIC_PW_DECODER = staticmethod(compile_record_decoder(_GENERIC_PW_HEADER, _GENERIC_PW_ATTRIBUTES))
+    INTERNET_PW_DECODER = staticmethod(compile_record_decoder(_INTERNET_PW_HEADER, _INTERNET_PW_ATTRIBUTES))
+    APPLE_SHARE_DECODER = staticmethod(compile_record_decoder(_APPLE_SHARE_HEADER, _APPLE_SHARE_ATTRIBUTES))
+    X509_CERT_DECODER = staticmethod(compile_record_decoder(_X509_CERT_HEADER, _X509_CERT_ATTRIBUTES))
+    SECKEY_DECODER = staticmethod(compile_record_decoder(_SECKEY_HEADER, _SECKEY_ATTRIBUTES))
+
+    def __init__(self, filepath, unlock_password=None, unlock_key=None, unlock_file=None, lazy_records=False):
         self._filepath = None
         self._unlock_password = None
         self._unlock_key = None
@@ -54,7 +80,6 @@ class Chainbreaker(object):
         self.schema_info = None
         self.table_list = None
         self.table_metadata = None
-        self.record_list = None
         self.table_count = None
         self.table_enum = None
         self.symmetric_key_list = None
@@ -62,9 +87,25 @@ class Chainbreaker(object):
         self.dbblob = None
         self.locked = True
 
+        # Return password and certificate records that decode their attributes on first access
+        self.lazy_records = lazy_records
+
+        # Table offset -> (table metadata, record offsets), filled in as tables are first read
+        self._tables = {}
+
+        # (table type, attribute) -> {attribute value: record offsets}, built by the find_* lookups as needed
+        self._indexes = {}
+
+        # Table type -> {attribute: {attribute value: record offsets}}, read from the table's on-disk indexes
+        self._disk_indexes = {}
+
         self.logger = logging.getLogger('Chainbreaker')
 
-        self.key_list = {}
+        # SSGP label -> (ciphertext, IV) of the symmetric key records with that label, read without decrypting them
+        self._symmetric_keys = None
+
+        # SSGP label -> symmetric key, for the labels looked up so far under db_key (None if no key decrypts)
+        self._key_list = {}
 
         self.db_key = None
 
@@ -77,108 +118,438 @@ class Chainbreaker(object):
         self.unlock_key = unlock_key
         self.unlock_file = unlock_file
 
-    # Returns a list of GenericPasswordRecord objects extracted from the Keychain
-    def dump_generic_passwords(self):
-        entries = []
+    # Releases the mapping of the keychain file. Records that were already dumped stay usable, except for
+    # attributes of lazy records that haven't been read yet.
+    def close(self):
+        if isinstance(self.kc_buffer, mmap.mmap):
+            self.kc_buffer.close()
+        self.kc_buffer = ''
+        self._tables = {}
+        self._indexes = {}
+        self._disk_indexes = {}
+        self._symmetric_keys = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Yields GenericPasswordRecord objects extracted from the Keychain, one at a time
+    def iter_generic_passwords(self, record_filter=None):
         try:
             table_metadata, generic_pw_list = self._get_table_from_type(CSSM_DL_DB_RECORD_GENERIC_PASSWORD)
+            generic_pw_list = self._matching_records(CSSM_DL_DB_RECORD_GENERIC_PASSWORD, generic_pw_list,
+                                                     _GENERIC_PW_HEADER, _GENERIC_PW_ATTRIBUTES, record_filter)
 
             for generic_pw_id in generic_pw_list:
-                entries.append(self._get_generic_password_record(generic_pw_id))
+                yield self._get_generic_password_record(generic_pw_id)
 
         except KeyError:
             self.logger.warning('[!] Generic Password Table is not available')
 
-        return entries
+    # Returns a list of GenericPasswordRecord objects extracted from the Keychain
+    def dump_generic_passwords(self, record_filter=None):
+        return list(self.iter_generic_passwords(record_filter))
 
-    # Returns a list of InterertPasswordRecord objects extracted from the Keychain
-    def dump_internet_passwords(self):
-        entries = []
+    # Yields InternetPasswordRecord objects extracted from the Keychain, one at a time
+    def iter_internet_passwords(self, record_filter=None):
         try:
             table_metadata, internet_pw_list = self._get_table_from_type(CSSM_DL_DB_RECORD_INTERNET_PASSWORD)
+            internet_pw_list = self._matching_records(CSSM_DL_DB_RECORD_INTERNET_PASSWORD, internet_pw_list,
+                                                      _INTERNET_PW_HEADER, _INTERNET_PW_ATTRIBUTES, record_filter)
 
             for internet_pw_id in internet_pw_list:
-                entries.append(self._get_internet_password_record(internet_pw_id))
+                yield self._get_internet_password_record(internet_pw_id)
 
         except KeyError:
             self.logger.warning('[!] Internet Password Table is not available')
-        return entries
 
-    # Returns a list of AppleshareRecord objects extracted from the Keychain
-    def dump_appleshare_passwords(self):
-        entries = []
+    # Returns a list of InterertPasswordRecord objects extracted from the Keychain
+    def dump_internet_passwords(self, record_filter=None):
+        return list(self.iter_internet_passwords(record_filter))
+
+    # Yields AppleshareRecord objects extracted from the Keychain, one at a time
+    def iter_appleshare_passwords(self, record_filter=None):
         try:
             table_metadata, appleshare_pw_list = self._get_table_from_type(CSSM_DL_DB_RECORD_APPLESHARE_PASSWORD)
+            appleshare_pw_list = self._matching_records(CSSM_DL_DB_RECORD_APPLESHARE_PASSWORD, appleshare_pw_list,
+                                                        _APPLE_SHARE_HEADER, _APPLE_SHARE_ATTRIBUTES, record_filter)
 
             for appleshare_pw_offset in appleshare_pw_list:
-                entries.append(self._get_appleshare_record(appleshare_pw_offset))
+                yield self._get_appleshare_record(appleshare_pw_offset)
 
         except KeyError:
             self.logger.warning('[!] Appleshare Records Table is not available')
-        return entries
 
-    # Returns a list of X509CertfificateRecord objects extracted from the Keychain
-    def dump_x509_certificates(self):
-        entries = []
+    # Returns a list of AppleshareRecord objects extracted from the Keychain
+    def dump_appleshare_passwords(self, record_filter=None):
+        return list(self.iter_appleshare_passwords(record_filter))
+
+    # Yields X509CertificateRecord objects extracted from the Keychain, one at a time
+    def iter_x509_certificates(self, record_filter=None):
         try:
             table_metadata, x509_cert_list = self._get_table_from_type(CSSM_DL_DB_RECORD_X509_CERTIFICATE)
+            x509_cert_list = self._matching_records(CSSM_DL_DB_RECORD_X509_CERTIFICATE, x509_cert_list,
+                                                    _X509_CERT_HEADER, _X509_CERT_ATTRIBUTES, record_filter)
 
-            for i, x509_cert_offset in enumerate(x509_cert_list, 1):
-                entries.append(self._get_x_509_record(x509_cert_offset))
+            for x509_cert_offset in x509_cert_list:
+                yield self._get_x_509_record(x509_cert_offset)
 
         except KeyError:
             self.logger.warning('[!] Certificate Table is not available')
 
-        return entries
+    # Returns a list of X509CertfificateRecord objects extracted from the Keychain
+    def dump_x509_certificates(self, record_filter=None):
+        return list(self.iter_x509_certificates(record_filter))
 
-    # Returns a list of PublicKeyRecord objects extracted from the Keychain
-    def dump_public_keys(self):
-        entries = []
+    # Yields PublicKeyRecord objects extracted from the Keychain, one at a time
+    def iter_public_keys(self, record_filter=None):
         try:
             table_metadata, public_key_list = self._get_table_from_type(CSSM_DL_DB_RECORD_PUBLIC_KEY)
-            for public_key_offset in public_key_list:
-                entries.append(
-                    self._get_public_key_record(public_key_offset))
+            for public_key_offset in self._matching_records(self._get_table_offset(CSSM_DL_DB_RECORD_PUBLIC_KEY),
+                                                            public_key_list, _SECKEY_HEADER, _SECKEY_ATTRIBUTES,
+                                                            record_filter):
+                yield self._get_public_key_record(public_key_offset)
         except KeyError:
             self.logger.warning('[!] Public Key Table is not available')
-        return entries
 
-    # Returns a list of PrivateKeyRecord objects extracted from the Keychain
-    def dump_private_keys(self):
-        entries = []
+    # Returns a list of PublicKeyRecord objects extracted from the Keychain
+    def dump_public_keys(self, record_filter=None):
+        return list(self.iter_public_keys(record_filter))
+
+    # Yields PrivateKeyRecord objects extracted from the Keychain, one at a time
+    def iter_private_keys(self, record_filter=None):
         try:
             table_meta, private_key_list = self._get_table_from_type(CSSM_DL_DB_RECORD_PRIVATE_KEY)
-            for i, private_key_offset in enumerate(private_key_list, 1):
-              try:
-                print("private_key_offset", self._get_private_key_record(private_key_offset))
-                entries.append(
-                    self._get_private_key_record(private_key_offset))
-
-              except Exception as e:
-                self.logger.warning(e)
+            private_key_list = self._matching_records(self._get_table_offset(CSSM_DL_DB_RECORD_PRIVATE_KEY),
+                                                      private_key_list, _SECKEY_HEADER, _SECKEY_ATTRIBUTES,
+                                                      record_filter)
+            for private_key_offset in private_key_list:
+                try:
+                    record = self._get_private_key_record(private_key_offset)
+                except Exception as e:
+                    self.logger.warning(e)
+                    continue
+
+                yield record
         except KeyError:
             self.logger.warning('[!] Private Key Table is not available')
-        return entries
 
-    # Attempts to read the keychain file into self.kc_buffer
+    # Returns a list of PrivateKeyRecord objects extracted from the Keychain
+    def dump_private_keys(self, record_filter=None):
+        return list(self.iter_private_keys(record_filter))
+
+    # Returns the GenericPasswordRecord objects with the given service and account. Criteria left as None
+    # match anything. Only the matching records are decoded.
+    def find_generic_passwords(self, service=None, account=None):
+        return [self._get_generic_password_record(offset) for offset in self._find_records(
+            CSSM_DL_DB_RECORD_GENERIC_PASSWORD, _GENERIC_PW_HEADER, _GENERIC_PW_ATTRIBUTES,
+            service=service, account=account)]
+
+    # Returns the first GenericPasswordRecord with the given service and account, or None
+    def find_generic_password(self, service=None, account=None):
+        records = self.find_generic_passwords(service=service, account=account)
+        return records[0] if records else None
+
+    # Returns the InternetPasswordRecord objects with the given server, account and protocol (a four character
+    # code such as 'htps'). Criteria left as None match anything. Only the matching records are decoded.
+    def find_internet_passwords(self, server=None, account=None, protocol=None):
+        return [self._get_internet_password_record(offset) for offset in self._find_records(
+            CSSM_DL_DB_RECORD_INTERNET_PASSWORD, _INTERNET_PW_HEADER, _INTERNET_PW_ATTRIBUTES,
+            server=server, account=account, protocol_type=protocol)]
+
+    # Returns the first InternetPasswordRecord with the given server, account and protocol, or None
+    def find_internet_password(self, server=None, account=None, protocol=None):
+        records = self.find_internet_passwords(server=server, account=account, protocol=protocol)
+        return records[0] if records else None
+
+    # Returns the PrivateKeyRecord objects with the given label and print name. Criteria left as None match
+    # anything. Only the matching records are decoded.
+    def find_private_keys(self, label=None, print_name=None):
+        return [self._get_private_key_record(offset) for offset in self._find_records(
+            CSSM_DL_DB_RECORD_PRIVATE_KEY, _SECKEY_HEADER, _SECKEY_ATTRIBUTES, label=label, print_name=print_name)]
+
+    # Returns the PublicKeyRecord objects with the given label and print name. Criteria left as None match
+    # anything. Only the matching records are decoded.
+    def find_public_keys(self, label=None, print_name=None):
+        return [self._get_public_key_record(offset) for offset in self._find_records(
+            CSSM_DL_DB_RECORD_PUBLIC_KEY, _SECKEY_HEADER, _SECKEY_ATTRIBUTES, label=label, print_name=print_name)]
+
+    # Returns the offsets, in table order, of the records of a table whose attributes equal the values in
+    # criteria (keyed by record class argument). Criteria that are None are ignored.
+    def _find_records(self, table_type, header_class, layout, **criteria):
+        try:
+            offsets = self._get_table_from_type(table_type)[1]
+        except KeyError:
+            return []
+
+        for name, value in criteria.items():
+            if value is not None:
+                matches = set(self._lookup(table_type, header_class, layout, name, value))
+                offsets = [offset for offset in offsets if offset in matches]
+
+        return offsets
+
+    # Returns the offsets of the records of a table whose attribute equals value. The keychain's own index on
+    # the attribute is searched if the table has a valid one. Otherwise the attribute is read from every
+    # record, once, into an index kept for later lookups.
+    def _lookup(self, table_type, header_class, layout, name, value):
+        disk_index = self._get_disk_indexes(table_type, header_class, layout).get(name)
+        if disk_index is not None:
+            try:
+                offsets = self._search_disk_index(table_type, disk_index, value)
+                Chainbreaker.disk_index_lookups += 1
+                return offsets
+            except (ValueError, struct.error) as e:
+                self.logger.debug("Ignoring the indexes of table %s: %s" % (table_type, e))
+                self._disk_indexes[table_type] = {}
+
+        Chainbreaker.scan_lookups += 1
+        return self._get_index(table_type, header_class, layout, name).get(value, ())
+
+    # Returns {attribute value: record offsets} for one attribute of a table, reading only that attribute of
+    # each record the first time it is asked for.
+    def _get_index(self, table_type, header_class, layout, name):
+        key = (table_type, name)
+        if key not in self._indexes:
+            index = {}
+            read = compile_raw_attribute_readers(header_class, layout)[name]
+            try:
+                base_addr = self._get_record_base_address(table_type)
+                for offset in self._get_table_from_type(table_type)[1]:
+                    index.setdefault(read(self.kc_buffer, base_addr + offset), []).append(offset)
+            except KeyError:
+                self.logger.debug("Unable to index table %s" % table_type)
+
+            self._indexes[key] = index
+
+        return self._indexes[key]
+
+    # Returns {attribute: (index address, _TABLE_INDEX, key reader, record attribute reader)} for the attributes
+    # a table has a valid on-disk index on. Indexes are read the first time a table is asked for, and all of a
+    # table's indexes are ignored if any of them is invalid.
+    def _get_disk_indexes(self, table_type, header_class, layout):
+        if table_type not in self._disk_indexes:
+            try:
+                self._disk_indexes[table_type] = self._read_disk_indexes(table_type, header_class, layout)
+            except (ValueError, struct.error) as e:
+                self.logger.debug("Ignoring the indexes of table %s: %s" % (table_type, e))
+                self._disk_indexes[table_type] = {}
+            except KeyError:
+                self._disk_indexes[table_type] = {}
+
+        return self._disk_indexes[table_type]
+
+    # Reads the indexes of a table, laid out as AppleDatabase writes them. An index holds sorted keys, each
+    # starting with the value of the attribute the index is on, and the record number of each key, which is the
+    # record's slot in the table's record offset array. Only the indexes and a few of the records they point at
+    # are read here: raises ValueError if an index doesn't fit in the index section, has a key or record number
+    # out of range or not one key per record, has keys out of order, or if its first, middle and last keys don't
+    # match their records.
+    def _read_disk_indexes(self, table_type, header_class, layout):
+        table_offset = self._get_table_offset(table_type)
+        table_metadata = self._get_table(table_offset)[0]
+        if not table_metadata.IndexesOffset:
+            return {}
+
+        table_addr = _APPL_DB_HEADER.STRUCT.size + table_offset
+        table_end = min(table_addr + table_metadata.TableSize, len(self.kc_buffer))
+        slot_count = (table_metadata.TableSize - _TABLE_HEADER.STRUCT.size) // Chainbreaker.ATOM_SIZE
+
+        # The index section starts with its size and the number of indexes, followed by the offsets of the
+        # indexes from the start of the section
+        section_addr = table_addr + table_metadata.IndexesOffset
+        if section_addr + 2 * Chainbreaker.ATOM_SIZE > table_end:
+            raise ValueError("indexes offset past the end of the table")
+
+        section_size, index_count = struct.unpack_from('>II', self.kc_buffer, section_addr)
+        section_end = section_addr + section_size
+        if section_end > table_end:
+            raise ValueError("index section runs past the end of the table")
+        if Chainbreaker.ATOM_SIZE * (index_count + 2) > section_size:
+            raise ValueError("%d indexes do not fit in the index section" % index_count)
+
+        key_readers = compile_index_key_readers(header_class, layout)
+        attribute_readers = compile_raw_attribute_readers(header_class, layout)
+
+        indexes = {}
+        for index_offset in struct.unpack_from('>%dI' % index_count, self.kc_buffer,
+                                               section_addr + 2 * Chainbreaker.ATOM_SIZE):
+            index_addr = section_addr + index_offset
+            if index_addr + _TABLE_INDEX.STRUCT.size > section_end:
+                raise ValueError("index offset %d past the end of the index section" % index_offset)
+
+            index = _TABLE_INDEX(self.kc_buffer, index_addr)
+            if index_addr + index.IndexSize > section_end:
+                raise ValueError("index %d runs past the end of the index section" % index.IndexId)
+
+            # Only the first attribute of a key can be searched on its own
+            if not index.AttributeIds or index.AttributeIds[0] not in key_readers:
+                continue
+
+            if len(index.KeyOffsets) != table_metadata.RecordCount:
+                raise ValueError("index %d has %d keys for %d records" % (
+                    index.IndexId, len(index.KeyOffsets), table_metadata.RecordCount))
+
+            if index.KeyOffsets and (min(index.KeyOffsets) < _TABLE_INDEX.STRUCT.size or
+                                     max(index.KeyOffsets) >= index.IndexSize or
+                                     max(index.RecordNumbers) >= slot_count):
+                raise ValueError("index %d has keys or record numbers out of range" % index.IndexId)
+
+            name, read_key = key_readers[index.AttributeIds[0]]
+            disk_index = (index_addr, index, read_key, attribute_readers[name])
+
+            # Lookups binary search the keys, so a key out of Python's order anywhere would hide records
+            values = [read_key(self.kc_buffer, index_addr, key_offset) for key_offset in index.KeyOffsets]
+            if any(values[i] > values[i + 1] for i in range(len(values) - 1)):
+                raise ValueError("index %d keys are not sorted" % index.IndexId)
+
+            for i in set([0, len(values) // 2, len(values) - 1]) if values else ():
+                self._read_disk_index_key(table_type, disk_index, i)
+
+            indexes[name] = disk_index
+
+        return indexes
+
+    # Returns the attribute value of key i of an on-disk index. Raises ValueError if the record the key is for
+    # isn't a record of the table or doesn't have that value.
+    def _read_disk_index_key(self, table_type, disk_index, i, offsets=None):
+        index_addr, index, read_key, read_attribute = disk_index
+        value = read_key(self.kc_buffer, index_addr, index.KeyOffsets[i])
+
+        table_addr = _APPL_DB_HEADER.STRUCT.size + self._get_table_offset(table_type)
+        record_number = index.RecordNumbers[i]
+        offset = _INT(self.kc_buffer, table_addr + _TABLE_HEADER.STRUCT.size +
+                      Chainbreaker.ATOM_SIZE * record_number).Value
+
+        record_addr = self._get_record_base_address(table_type) + offset
+        if (offset == 0x00 or offset % 4 or _INT(self.kc_buffer, record_addr + Chainbreaker.ATOM_SIZE).Value !=
+                record_number or read_attribute(self.kc_buffer, record_addr) != value):
+            raise ValueError("index %d key %d does not match its record" % (index.IndexId, i))
+
+        if offsets is not None:
+            offsets.append(offset)
+        return value
+
+    # Returns the offsets of the records whose key in an on-disk index starts with value. The keys are binary
+    # searched, and only the matching records are read, to check they do have the value.
+    def _search_disk_index(self, table_type, disk_index, value):
+        index_addr, index, read_key, read_attribute = disk_index
+
+        low, high = 0, len(index.KeyOffsets)
+        while low < high:
+            middle = (low + high) // 2
+            if read_key(self.kc_buffer, index_addr, index.KeyOffsets[middle]) < value:
+                low = middle + 1
+            else:
+                high = middle
+
+        offsets = []
+        while low < len(index.KeyOffsets) and read_key(self.kc_buffer, index_addr, index.KeyOffsets[low]) == value:
+            self._read_disk_index_key(table_type, disk_index, low, offsets)
+            low += 1
+
+        return offsets
+
+    # Address that record offsets of a table are relative to. Key records are addressed through their table
+    # offset, as in _get_key_record.
+    def _get_record_base_address(self, table_type):
+        if table_type in (CSSM_DL_DB_RECORD_PRIVATE_KEY, CSSM_DL_DB_RECORD_PUBLIC_KEY):
+            return self._get_base_address(self._get_table_offset(table_type))
+        return self._get_base_address(table_type)
+
+    # Returns an iterable over the offsets in record_list (of the table table_name) of the records that match
+    # record_filter, a RecordFilter or filter expression. Only the attributes the filter names are read. All of
+    # record_list if record_filter is None.
+    def _matching_records(self, table_name, record_list, header_class, layout, record_filter):
+        if record_filter is None:
+            return record_list
+
+        if not isinstance(record_filter, RecordFilter):
+            record_filter = RecordFilter(record_filter)
+
+        predicate = record_filter.compile(header_class, layout)
+        if predicate is None:
+            return []
+
+        base_addr = self._get_base_address(table_name)
+        return (offset for offset in record_list if predicate(self.kc_buffer, base_addr + offset))
+
+    # Decrypts the SSGP password of every record in records (Generic, Internet or Appleshare records) in one
+    # pass. Records are grouped by DBKey so each key is only set up once with the crypto backend. The records
+    # are filled in as if their Password property had been read.
+    def decrypt_all_passwords(self, records):
+        records_by_key = {}
+        for record in records:
+            if record.SSGP and record.DBKey:
+                records_by_key.setdefault(record.DBKey, []).append(record)
+
+        backend = Chainbreaker.get_crypto_backend()
+        for dbkey, key_records in records_by_key.items():
+            # Payloads _kcdecrypt would refuse are left for the record's own decrypt_password()
+            key_records = [r for r in key_records if r.SSGP.EncryptedPassword and
+                           len(r.SSGP.EncryptedPassword) % Chainbreaker.BLOCKSIZE == 0]
+
+            plaintexts = backend.decrypt_many(dbkey, [(str(bytearray(r.SSGP.IV)), r.SSGP.EncryptedPassword)
+                                                      for r in key_records])
+
+            for record, plain in zip(key_records, plaintexts):
+                record.set_password(Chainbreaker._strip_padding(plain))
+
+        return records
+
+    # Yields the records from an iterable of Generic, Internet or Appleshare records with their passwords
+    # decrypted, passing them to decrypt_all_passwords batch_size at a time.
+    def iter_decrypted_passwords(self, records, batch_size=64):
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                for decrypted in self.decrypt_all_passwords(batch):
+                    yield decrypted
+                batch = []
+
+        for decrypted in self.decrypt_all_passwords(batch):
+            yield decrypted
+
+    # Attempts to map the keychain file into self.kc_buffer
     # On success it extracts out relevant information (table information, key offsets, and the DB BLob)
     def _read_keychain_to_buffer(self):
         try:
             with open(self.filepath, 'rb') as fp:
-                self.kc_buffer = fp.read()
+                # Only a regular, non-empty file can be mapped. Pipes (e.g. /dev/stdin or process substitution),
+                # and files mmap fails on, are read into memory instead.
+                self.kc_buffer = ''
+                file_stat = os.fstat(fp.fileno())
+                if stat.S_ISREG(file_stat.st_mode) and file_stat.st_size:
+                    try:
+                        self.kc_buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+                    except EnvironmentError as e:
+                        self.logger.debug("Unable to map keychain, reading it instead: %s" % e)
+
+                if not isinstance(self.kc_buffer, mmap.mmap):
+                    self.kc_buffer = fp.read()
+
+            self._tables = {}
+            self._indexes = {}
+            self._disk_indexes = {}
+            self._symmetric_keys = None
+            self._key_list = {}
 
             if self.kc_buffer:
-                self.header = _APPL_DB_HEADER(self.kc_buffer[:_APPL_DB_HEADER.STRUCT.size])
+                self.header = _APPL_DB_HEADER(self.kc_buffer)
                 self.schema_info, self.table_list = self._get_schema_info(self.header.SchemaOffset)
-                self.table_metadata, self.record_list = self._get_table(self.table_list[0])
-                self.table_count, self.table_enum = self._get_table_name_to_list(self.record_list, self.table_list)
+                self.table_metadata = self._get_table_header(self.table_list[0])
+                self.table_count, self.table_enum = self._get_table_name_to_list(self.table_metadata.RecordCount,
+                                                                                 self.table_list)
 
                 self.symmetric_key_offset = self.table_list[self.table_enum[CSSM_DL_DB_RECORD_METADATA]]
 
                 self.base_addr = _APPL_DB_HEADER.STRUCT.size + self.symmetric_key_offset + 0x38
-                self.dbblob = _DB_BLOB(self.kc_buffer[self.base_addr:self.base_addr + _DB_BLOB.STRUCT.size])
+                self.dbblob = _DB_BLOB(self.kc_buffer, self.base_addr)
 
-        except OSError as e:
+        except EnvironmentError as e:
             self.logger.critical("Unable to read keychain: %s" % e)
 
     # Simple check to make sure the keychain we're looking at is valid.
@@ -188,29 +559,53 @@ class Chainbreaker(object):
             return False
         return True
 
-    # When the keychain is successfully decrypted ("unlocked"), we can obtain a list of encryption keys
-    # used to encrypt individual records, indexed off of the SSGB label.
-    def _generate_key_list(self):
-        table_meta_data, symmetric_key_list = self._get_table_from_type(CSSM_DL_DB_RECORD_SYMMETRIC_KEY)
-
-        for symmetric_key_record in symmetric_key_list:
-            keyblob, ciphertext, iv, return_value = self._get_keyblob_record(symmetric_key_record)
-            if return_value == 0:
-                password = Chainbreaker.keyblob_decryption(ciphertext, iv, self.db_key)
-                if password != '':
-                    self.key_list[keyblob] = password
-
-        return len(self.key_list)
+    # When the keychain is successfully decrypted ("unlocked"), we can obtain the encryption keys used to
+    # encrypt individual records, indexed off of the SSGP label. Only the labels are read up front, each key is
+    # decrypted by _get_symmetric_key when a record first needs it.
+    def _get_symmetric_key_records(self):
+        if self._symmetric_keys is None:
+            self._symmetric_keys = {}
+            try:
+                symmetric_key_list = self._get_table_from_type(CSSM_DL_DB_RECORD_SYMMETRIC_KEY)[1]
+            except KeyError:
+                symmetric_key_list = []
+
+            for symmetric_key_record in symmetric_key_list:
+                keyblob, ciphertext, iv, return_value = self._get_keyblob_record(symmetric_key_record)
+                if return_value == 0:
+                    self._symmetric_keys.setdefault(keyblob, []).append((ciphertext, iv))
+
+        return self._symmetric_keys
+
+    # Returns the key for an SSGP label, or None if the keychain is locked or none of the symmetric key records
+    # with the label decrypts. Records are decrypted the first time their label is asked for.
+    def _get_symmetric_key(self, label):
+        if label not in self._key_list:
+            key = None
+            if self.db_key:
+                # Later records with the same label take precedence
+                for ciphertext, iv in reversed(self._get_symmetric_key_records().get(label, [])):
+                    key = Chainbreaker.keyblob_decryption(ciphertext, iv, self.db_key) or None
+                    if key:
+                        break
+            self._key_list[label] = key
+
+        return self._key_list[label]
+
+    # Every symmetric key that decrypts under db_key, by SSGP label. Decrypts all of them.
+    @property
+    def key_list(self):
+        keys = ((label, self._get_symmetric_key(label)) for label in self._get_symmetric_key_records())
+        return dict((label, key) for label, key in keys if key)
 
     # Returns basic schema (table count, size) and a list of the tables from the Keychain file.
     def _get_schema_info(self, offset):
         table_list = []
-        schema_info = _APPL_DB_SCHEMA(self.kc_buffer[offset:offset + _APPL_DB_SCHEMA.STRUCT.size])
+        schema_info = _APPL_DB_SCHEMA(self.kc_buffer, offset)
 
         for i in range(schema_info.TableCount):
             base_addr = _APPL_DB_HEADER.STRUCT.size + _APPL_DB_SCHEMA.STRUCT.size
-            table_list.append(_TABLE_ID(self.kc_buffer[base_addr + (Chainbreaker.ATOM_SIZE * i):base_addr + (
-                    Chainbreaker.ATOM_SIZE * i) + Chainbreaker.ATOM_SIZE]).Value)
+            table_list.append(_TABLE_ID(self.kc_buffer, base_addr + (Chainbreaker.ATOM_SIZE * i)).Value)
 
         return schema_info, table_list
 
@@ -223,48 +618,67 @@ class Chainbreaker(object):
     def _get_table_from_type(self, table_type):
         return self._get_table(self._get_table_offset(table_type))
 
-    # Returns a both the metadata and a record list for a table, given an offset.
+    # Record offsets of the first table
+    @property
+    def record_list(self):
+        return self._get_table(self.table_list[0])[1]
+
+    # Returns just the metadata of a table, given an offset.
+    def _get_table_header(self, offset):
+        return _TABLE_HEADER(self.kc_buffer, _APPL_DB_HEADER.STRUCT.size + offset)
+
+    # Returns a both the metadata and a record list for a table, given an offset. The record list is only read
+    # the first time a table is asked for.
     def _get_table(self, offset):
+        if offset not in self._tables:
+            self._tables[offset] = self._read_table(offset)
+        return self._tables[offset]
+
+    # Reads a table's record offset array. Free slots hold 0, so slots are decoded in bulk until RecordCount
+    # valid offsets are found, never reading past the end of the table.
+    def _read_table(self, offset):
         record_list = []
 
         base_addr = _APPL_DB_HEADER.STRUCT.size + offset
-        table_metadata = _TABLE_HEADER(self.kc_buffer[base_addr:base_addr + _TABLE_HEADER.STRUCT.size])
+        table_metadata = _TABLE_HEADER(self.kc_buffer, base_addr)
         record_offset_base = base_addr + _TABLE_HEADER.STRUCT.size
 
-        record_count = 0
-        offset = 0
-        while table_metadata.RecordCount != record_count:
-            record_offset = _RECORD_OFFSET(self.kc_buffer[
-                                           record_offset_base + (Chainbreaker.ATOM_SIZE * offset):record_offset_base + (
-                                                   Chainbreaker.ATOM_SIZE * offset) + Chainbreaker.ATOM_SIZE]).Value
+        max_slots = max(0, min(table_metadata.TableSize - _TABLE_HEADER.STRUCT.size,
+                               len(self.kc_buffer) - record_offset_base)) // Chainbreaker.ATOM_SIZE
 
-            if (record_offset != 0x00) and (record_offset % 4 == 0):
-                record_list.append(record_offset)
-                record_count += 1
-            offset += 1
+        slots = 0
+        while len(record_list) < table_metadata.RecordCount and slots < max_slots:
+            count = min(max(table_metadata.RecordCount - len(record_list), 16), max_slots - slots)
+            record_offsets = struct.unpack_from('>%dI' % count, self.kc_buffer,
+                                                record_offset_base + Chainbreaker.ATOM_SIZE * slots)
+            slots += count
 
-        return table_metadata, record_list
+            record_list.extend(o for o in record_offsets if o != 0x00 and o % 4 == 0)
 
-    # Returns a dict of table indexes keyed off of the TableId
-    def _get_table_name_to_list(self, record_list, table_list):
+        if len(record_list) < table_metadata.RecordCount:
+            self.logger.debug("Table at offset %d has only %d of its %d records" % (
+                offset, len(record_list), table_metadata.RecordCount))
+
+        return table_metadata, record_list[:table_metadata.RecordCount]
+
+    # Returns a dict of table indexes keyed off of the TableId. Only the table headers are read.
+    def _get_table_name_to_list(self, table_count, table_list):
         table_dict = {}
-        for count in range(len(record_list)):
-            table_metadata, generic_list = self._get_table(table_list[count])
-            table_dict[table_metadata.TableId] = count  # extract valid table list
+        for count in range(table_count):
+            table_dict[self._get_table_header(table_list[count]).TableId] = count  # extract valid table list
 
-        return len(record_list), table_dict
+        return table_count, table_dict
 
     def _get_keyblob_record(self, record_offset):
 
         base_addr = self._get_base_address(CSSM_DL_DB_RECORD_SYMMETRIC_KEY, record_offset)
 
-        key_blob_record_header = _KEY_BLOB_REC_HEADER(
-            self.kc_buffer[base_addr:base_addr + _KEY_BLOB_REC_HEADER.STRUCT.size])
+        key_blob_record_header = _KEY_BLOB_REC_HEADER(self.kc_buffer, base_addr)
 
         record = self.kc_buffer[
                  base_addr + _KEY_BLOB_REC_HEADER.STRUCT.size:base_addr + key_blob_record_header.RecordSize]
 
-        key_blob_record = _KEY_BLOB(record[:+_KEY_BLOB.STRUCT.size])
+        key_blob_record = _KEY_BLOB(record)
 
         if SECURE_STORAGE_GROUP != str(record[key_blob_record.TotalLength + 8:key_blob_record.TotalLength + 8 + 4]):
             return '', '', '', 1
@@ -280,47 +694,6 @@ class Chainbreaker(object):
         return record[
                key_blob_record.TotalLength + 8:key_blob_record.TotalLength + 8 + 20], cipher_text, key_blob_record.IV, 0
 
-    # Get a timestamp from the keychain buffer
-    def _get_keychain_time(self, base_addr, pcol):
-        if pcol <= 0:
-            return ''
-        else:
-            return _KEYCHAIN_TIME(self.kc_buffer[base_addr + pcol:base_addr + pcol + _KEYCHAIN_TIME.STRUCT.size]).Time
-
-    # Get an integer from the keychain buffer
-    def _get_int(self, base_addr, pcol):
-        if pcol <= 0:
-            return 0
-        else:
-            return _INT(self.kc_buffer[base_addr + pcol:base_addr + pcol + 4]).Value
-
-    # Get 4 character code from the keychain buffer
-    def _get_four_char_code(self, base_addr, pcol):
-        if pcol <= 0:
-            return ''
-        else:
-            return _FOUR_CHAR_CODE(self.kc_buffer[base_addr + pcol:base_addr + pcol + 4]).Value
-
-    # Get an lv from the keychain buffer
-    def _get_lv(self, base_addr, pcol):
-        if pcol <= 0:
-            return ''
-
-        str_length = _INT(self.kc_buffer[base_addr + pcol:base_addr + pcol + 4]).Value
-        # 4byte arrangement
-        if (str_length % 4) == 0:
-            real_str_len = (str_length / 4) * 4
-        else:
-            real_str_len = ((str_length / 4) + 1) * 4
-
-        try:
-            data = _LV(self.kc_buffer[base_addr + pcol + 4:base_addr + pcol + 4 + real_str_len], real_str_len).Value
-        except struct.error:
-            self.logger.debug('LV string length is too long.')
-            return ''
-
-        return data
-
     #
     # # http://opensource.apple.com/source/libsecurity_keychain/libsecurity_keychain-55044/lib/KeyItem.cpp
     def _private_key_decryption(self, encryptedblob, iv):
@@ -345,7 +718,17 @@ class Chainbreaker(object):
 
     # ## Documents : http://www.opensource.apple.com/source/securityd/securityd-55137.1/doc/BLOBFORMAT
     def _generate_master_key(self, pw):
-        return str(PBKDF2(pw, str(bytearray(self.dbblob.Salt)), 1000, Chainbreaker.KEYLEN))
+        return Chainbreaker.get_crypto_backend().pbkdf2(pw, str(bytearray(self.dbblob.Salt)), 1000,
+                                                        Chainbreaker.KEYLEN)
+
+    # Returns the master key stored in an unlock file (e.g. SystemKey), or None if it can't be read
+    def _read_unlock_file(self, filepath):
+        try:
+            with open(filepath, mode='rb') as uf:
+                return _UNLOCK_BLOB(uf.read()).MasterKey
+        except (IOError, OSError, struct.error) as e:
+            self.logger.warning("Unable to read unlock file: %s" % e)
+            return None
 
     # ## find DBBlob and extract Wrapping key
     def _find_wrapping_key(self, master):
@@ -354,7 +737,7 @@ class Chainbreaker(object):
                      self.base_addr + self.dbblob.StartCryptoBlob:self.base_addr + self.dbblob.TotalLength]
 
         # decrypt the key
-        plain = Chainbreaker._kcdecrypt(master, self.dbblob.IV, ciphertext)
+        plain = Chainbreaker._kcdecrypt(master, self.dbblob.IV, ciphertext, verify=True)
 
         if plain.__len__() < Chainbreaker.KEYLEN:
             return ''
@@ -364,6 +747,65 @@ class Chainbreaker(object):
         # return encrypted wrapping key
         return dbkey
 
+    # Checks unlock options without unlocking the keychain. Returns True if any of them gives the db key: the
+    # DBBlob has to decrypt to a correctly padded key under the master key, and as about one wrong master key
+    # in 256 passes that by chance, a symmetric key record also has to unwrap under the db key. Options are
+    # tried cheapest first, and symmetric keys only up to the first one that unwraps.
+    def check_unlock_options(self, unlock_password=None, unlock_key=None, unlock_file=None):
+        if unlock_key and self._unwraps_symmetric_key(self._find_wrapping_key(unhexlify(unlock_key))):
+            return True
+
+        if unlock_file:
+            master_key = self._read_unlock_file(unlock_file)
+            if master_key is not None and self._unwraps_symmetric_key(self._find_wrapping_key(master_key)):
+                return True
+
+        if unlock_password:
+            master_key = self._generate_master_key(unlock_password)
+            if self._unwraps_symmetric_key(self._find_wrapping_key(master_key)):
+                return True
+
+        return False
+
+    # Returns True if any symmetric key record unwraps under db_key, stopping at the first one that does
+    def _unwraps_symmetric_key(self, db_key):
+        if not db_key:
+            return False
+
+        for key_records in self._get_symmetric_key_records().values():
+            for ciphertext, iv in key_records:
+                if Chainbreaker.keyblob_decryption(ciphertext, iv, db_key):
+                    return True
+
+        return False
+
+    # Check many candidate master keys (e.g. carved from a memory image) against the DBBlob at once.
+    # Returns a list with True for each key that decrypts the DBBlob to correctly padded data; these are only
+    # likely matches and still have to be confirmed by unlocking with them.
+    def check_master_keys(self, candidates):
+        tail = self._get_db_blob_tail()
+        if tail is None:
+            return [False] * len(candidates)
+
+        chain, block = tail
+        return padding_mask(candidates, chain, block)
+
+    # Returns the last block of the DBBlob ciphertext and the block (or IV) it is chained from, which is all
+    # that is needed to check the padding under a candidate master key. None if the DBBlob is malformed.
+    def _get_db_blob_tail(self):
+        ciphertext = self.kc_buffer[
+                     self.base_addr + self.dbblob.StartCryptoBlob:self.base_addr + self.dbblob.TotalLength]
+
+        if len(ciphertext) == 0 or len(ciphertext) % Chainbreaker.BLOCKSIZE != 0:
+            return None
+
+        if len(ciphertext) > Chainbreaker.BLOCKSIZE:
+            chain = ciphertext[-2 * Chainbreaker.BLOCKSIZE:-Chainbreaker.BLOCKSIZE]
+        else:
+            chain = str(bytearray(self.dbblob.IV))
+
+        return chain, ciphertext[-Chainbreaker.BLOCKSIZE:]
+
     # Extract the Cyphertext, IV, and Salt for the keychain file, for use with offline cracking (e.g. Hashcat)
     # Returns a KeychainPasswordHash object
     def dump_keychain_password_hash(self):
@@ -379,31 +821,16 @@ class Chainbreaker(object):
     def _get_appleshare_record(self, record_offset):
         base_addr = self._get_base_address(CSSM_DL_DB_RECORD_APPLESHARE_PASSWORD, record_offset)
 
-        record_meta = _APPLE_SHARE_HEADER(self.kc_buffer[base_addr:base_addr + _APPLE_SHARE_HEADER.STRUCT.size])
-
-        buffer = self.kc_buffer[base_addr + _APPLE_SHARE_HEADER.STRUCT.size:base_addr + record_meta.RecordSize]
-
-        ssgp, dbkey = self._extract_ssgp_and_dbkey(record_meta, buffer)
-
-        return self.AppleshareRecord(
-            created=self._get_keychain_time(base_addr, record_meta.CreationDate & 0xFFFFFFFE),
-            last_modified=self._get_keychain_time(base_addr, record_meta.ModDate & 0xFFFFFFFE),
-            description=self._get_lv(base_addr, record_meta.Description & 0xFFFFFFFE),
-            comment=self._get_lv(base_addr, record_meta.Comment & 0xFFFFFFFE),
-            creator=self._get_four_char_code(base_addr, record_meta.Creator & 0xFFFFFFFE),
-            type=self._get_four_char_code(base_addr, record_meta.Type & 0xFFFFFFFE),
-            print_name=self._get_lv(base_addr, record_meta.PrintName & 0xFFFFFFFE),
-            alias=self._get_lv(base_addr, record_meta.Alias & 0xFFFFFFFE),
-            protected=self._get_lv(base_addr, record_meta.Protected & 0xFFFFFFFE),
-            account=self._get_lv(base_addr, record_meta.Account & 0xFFFFFFFE),
-            volume=self._get_lv(base_addr, record_meta.Volume & 0xFFFFFFFE),
-            server=self._get_lv(base_addr, record_meta.Server & 0xFFFFFFFE),
-            protocol_type=self._get_four_char_code(base_addr, record_meta.Protocol & 0xFFFFFFFE),
-            address=self._get_lv(base_addr, record_meta.Address & 0xFFFFFFFE),
-            signature=self._get_lv(base_addr, record_meta.Signature & 0xFFFFFFFE),
-            ssgp=ssgp,
-            dbkey=dbkey
-        )
+        if self.lazy_records:
+            record_meta = _APPLE_SHARE_HEADER(self.kc_buffer, base_addr)
+            ssgp, dbkey = self._extract_ssgp_and_dbkey(record_meta, base_addr, _APPLE_SHARE_HEADER.STRUCT.size)
+            return self.LazyAppleshareRecord(self.kc_buffer, base_addr, record_meta, ssgp=ssgp, dbkey=dbkey)
+
+        record_meta, attributes = Chainbreaker.APPLE_SHARE_DECODER(self.kc_buffer, base_addr)
+
+        ssgp, dbkey = self._extract_ssgp_and_dbkey(record_meta, base_addr, _APPLE_SHARE_HEADER.STRUCT.size)
+
+        return self.AppleshareRecord(ssgp=ssgp, dbkey=dbkey, **attributes)
 
     def _get_private_key_record(self, record_offset):
         record = self._get_key_record(self._get_table_offset(CSSM_DL_DB_RECORD_PRIVATE_KEY), record_offset)
@@ -447,111 +874,81 @@ class Chainbreaker(object):
     def _get_key_record(self, table_name, record_offset):  ## PUBLIC and PRIVATE KEY
         base_addr = self._get_base_address(table_name, record_offset)
 
-        record_meta = _SECKEY_HEADER(self.kc_buffer[base_addr:base_addr + _SECKEY_HEADER.STRUCT.size])
+        record_meta, attributes = Chainbreaker.SECKEY_DECODER(self.kc_buffer, base_addr)
 
         key_blob = self.kc_buffer[
                    base_addr + _SECKEY_HEADER.STRUCT.size:base_addr + _SECKEY_HEADER.STRUCT.size + record_meta.BlobSize]
 
         iv, key = Chainbreaker._get_encrypted_data_in_blob(key_blob)
 
-        return [self._get_lv(base_addr, record_meta.PrintName & 0xFFFFFFFE),
-                self._get_lv(base_addr, record_meta.Label & 0xFFFFFFFE),
-                self._get_int(base_addr, record_meta.KeyClass & 0xFFFFFFFE),
-                self._get_int(base_addr, record_meta.Private & 0xFFFFFFFE),
-                CSSM_ALGORITHMS[self._get_int(base_addr, record_meta.KeyType & 0xFFFFFFFE)],
-                self._get_int(base_addr, record_meta.KeySizeInBits & 0xFFFFFFFE),
-                self._get_int(base_addr, record_meta.EffectiveKeySize & 0xFFFFFFFE),
-                self._get_int(base_addr, record_meta.Extractable & 0xFFFFFFFE),
-                STD_APPLE_ADDIN_MODULE[
-                    str(self._get_lv(base_addr, record_meta.KeyCreator & 0xFFFFFFFE)).split('\x00')[0]],
+        return [attributes['print_name'],
+                attributes['label'],
+                attributes['key_class'],
+                attributes['private'],
+                CSSM_ALGORITHMS[attributes['key_type']],
+                attributes['key_size'],
+                attributes['effective_key_size'],
+                attributes['extracted'],
+                STD_APPLE_ADDIN_MODULE[str(attributes['key_creator']).split('\x00')[0]],
                 iv,
                 key]
 
     def _get_x_509_record(self, record_offset):
         base_addr = self._get_base_address(CSSM_DL_DB_RECORD_X509_CERTIFICATE, record_offset)
 
-        record_meta = _X509_CERT_HEADER(self.kc_buffer[base_addr:base_addr + _X509_CERT_HEADER.STRUCT.size])
+        if self.lazy_records:
+            record_meta = _X509_CERT_HEADER(self.kc_buffer, base_addr)
+            return self.LazyX509CertificateRecord(self.kc_buffer, base_addr, record_meta)
+
+        record_meta, attributes = Chainbreaker.X509_CERT_DECODER(self.kc_buffer, base_addr)
 
         return self.X509CertificateRecord(
-            type=self._get_int(base_addr, record_meta.CertType & 0xFFFFFFFE),
-            encoding=self._get_int(base_addr, record_meta.CertEncoding & 0xFFFFFFFE),
-            print_name=self._get_lv(base_addr, record_meta.PrintName & 0xFFFFFFFE),
-            alias=self._get_lv(base_addr, record_meta.Alias & 0xFFFFFFFE),
-            subject=self._get_lv(base_addr, record_meta.Subject & 0xFFFFFFFE),
-            issuer=self._get_lv(base_addr, record_meta.Issuer & 0xFFFFFFFE),
-            serial_number=self._get_lv(base_addr, record_meta.SerialNumber & 0xFFFFFFFE),
-            subject_key_identifier=self._get_lv(base_addr, record_meta.SubjectKeyIdentifier & 0xFFFFFFFE),
-            public_key_hash=self._get_lv(base_addr, record_meta.PublicKeyHash & 0xFFFFFFFE),
             certificate=self.kc_buffer[
-                        base_addr + _X509_CERT_HEADER.STRUCT.size:base_addr + _X509_CERT_HEADER.STRUCT.size + record_meta.CertSize]
+                        base_addr + _X509_CERT_HEADER.STRUCT.size:base_addr + _X509_CERT_HEADER.STRUCT.size + record_meta.CertSize],
+            **attributes
         )
 
-    def _extract_ssgp_and_dbkey(self, record_meta, buffer):
+    # The SSGP area sits right after the record header (header_size bytes at base_addr), and can't run past the
+    # end of the record.
+    def _extract_ssgp_and_dbkey(self, record_meta, base_addr, header_size):
         ssgp = None
         dbkey = None
 
         if record_meta.SSGPArea != 0:
-            ssgp = _SSGP(buffer[:record_meta.SSGPArea])
-            dbkey_index = ssgp.Magic + ssgp.Label
-
-            if dbkey_index in self.key_list:
-                dbkey = self.key_list[dbkey_index]
+            start = base_addr + header_size
+            end = min(start + record_meta.SSGPArea, base_addr + record_meta.RecordSize)
+            ssgp = _SSGP(self.kc_buffer[start:end])
+            dbkey = self._get_symmetric_key(ssgp.Magic + ssgp.Label)
 
         return ssgp, dbkey
 
     def _get_internet_password_record(self, record_offset):
         base_addr = self._get_base_address(CSSM_DL_DB_RECORD_INTERNET_PASSWORD, record_offset)
-        record_meta = _INTERNET_PW_HEADER(self.kc_buffer[base_addr:base_addr + _INTERNET_PW_HEADER.STRUCT.size])
-
-        buffer = self.kc_buffer[base_addr + _INTERNET_PW_HEADER.STRUCT.size:base_addr + record_meta.RecordSize]
-
-        ssgp, dbkey = self._extract_ssgp_and_dbkey(record_meta, buffer)
-
-        return self.InternetPasswordRecord(
-            created=self._get_keychain_time(base_addr, record_meta.CreationDate & 0xFFFFFFFE),
-            last_modified=self._get_keychain_time(base_addr, record_meta.ModDate & 0xFFFFFFFE),
-            description=self._get_lv(base_addr, record_meta.Description & 0xFFFFFFFE),
-            comment=self._get_lv(base_addr, record_meta.Comment & 0xFFFFFFFE),
-            creator=self._get_four_char_code(base_addr, record_meta.Creator & 0xFFFFFFFE),
-            type=self._get_four_char_code(base_addr, record_meta.Type & 0xFFFFFFFE),
-            print_name=self._get_lv(base_addr, record_meta.PrintName & 0xFFFFFFFE),
-            alias=self._get_lv(base_addr, record_meta.Alias & 0xFFFFFFFE),
-            protected=self._get_lv(base_addr, record_meta.Protected & 0xFFFFFFFE),
-            account=self._get_lv(base_addr, record_meta.Account & 0xFFFFFFFE),
-            security_domain=self._get_lv(base_addr, record_meta.SecurityDomain & 0xFFFFFFFE),
-            server=self._get_lv(base_addr, record_meta.Server & 0xFFFFFFFE),
-            protocol_type=self._get_four_char_code(base_addr, record_meta.Protocol & 0xFFFFFFFE),
-            auth_type=self._get_lv(base_addr, record_meta.AuthType & 0xFFFFFFFE),
-            port=self._get_int(base_addr, record_meta.Port & 0xFFFFFFFE),
-            path=self._get_lv(base_addr, record_meta.Path & 0xFFFFFFFE),
-            ssgp=ssgp,
-            dbkey=dbkey
-        )
+
+        if self.lazy_records:
+            record_meta = _INTERNET_PW_HEADER(self.kc_buffer, base_addr)
+            ssgp, dbkey = self._extract_ssgp_and_dbkey(record_meta, base_addr, _INTERNET_PW_HEADER.STRUCT.size)
+            return self.LazyInternetPasswordRecord(self.kc_buffer, base_addr, record_meta, ssgp=ssgp, dbkey=dbkey)
+
+        record_meta, attributes = Chainbreaker.INTERNET_PW_DECODER(self.kc_buffer, base_addr)
+
+        ssgp, dbkey = self._extract_ssgp_and_dbkey(record_meta, base_addr, _INTERNET_PW_HEADER.STRUCT.size)
+
+        return self.InternetPasswordRecord(ssgp=ssgp, dbkey=dbkey, **attributes)
 
     def _get_generic_password_record(self, record_offset):
         base_addr = self._get_base_address(CSSM_DL_DB_RECORD_GENERIC_PASSWORD, record_offset)
 
-        record_meta = _GENERIC_PW_HEADER(self.kc_buffer[base_addr:base_addr + _GENERIC_PW_HEADER.STRUCT.size])
-
-        buffer = self.kc_buffer[
-                 base_addr + _GENERIC_PW_HEADER.STRUCT.size:base_addr + record_meta.RecordSize]
+        if self.lazy_records:
+            record_meta = _GENERIC_PW_HEADER(self.kc_buffer, base_addr)
+            ssgp, dbkey = self._extract_ssgp_and_dbkey(record_meta, base_addr, _GENERIC_PW_HEADER.STRUCT.size)
+            return self.LazyGenericPasswordRecord(self.kc_buffer, base_addr, record_meta, ssgp=ssgp, dbkey=dbkey)
 
-        ssgp, dbkey = self._extract_ssgp_and_dbkey(record_meta, buffer)
+        record_meta, attributes = Chainbreaker.GENERIC_PW_DECODER(self.kc_buffer, base_addr)
 
-        return self.GenericPasswordRecord(
-            created=self._get_keychain_time(base_addr, record_meta.CreationDate & 0xFFFFFFFE),
-            last_modified=self._get_keychain_time(base_addr, record_meta.ModDate & 0xFFFFFFFE),
-            description=self._get_lv(base_addr, record_meta.Description & 0xFFFFFFFE),
-            creator=self._get_four_char_code(base_addr, record_meta.Creator & 0xFFFFFFFE),
-            type=self._get_four_char_code(base_addr, record_meta.Type & 0xFFFFFFFE),
-            print_name=self._get_lv(base_addr, record_meta.PrintName & 0xFFFFFFFE),
-            alias=self._get_lv(base_addr, record_meta.Alias & 0xFFFFFFFE),
-            account=self._get_lv(base_addr, record_meta.Account & 0xFFFFFFFE),
-            service=self._get_lv(base_addr, record_meta.Service & 0xFFFFFFFE),
-            ssgp=ssgp,
-            dbkey=dbkey)
+        ssgp, dbkey = self._extract_ssgp_and_dbkey(record_meta, base_addr, _GENERIC_PW_HEADER.STRUCT.size)
 
-        return record
+        return self.GenericPasswordRecord(ssgp=ssgp, dbkey=dbkey, **attributes)
 
     def _get_base_address(self, table_name, offset=None):
         if table_name == 23972:
@@ -606,14 +1003,9 @@ class Chainbreaker(object):
         self._unlock_file = filepath
 
         if self._unlock_file:
-            try:
-                with open(self._unlock_file, mode='rb') as uf:
-                    file_content = uf.read()
-
-                unlock_key_blob = _UNLOCK_BLOB(file_content)
-                self.db_key = self._find_wrapping_key(unlock_key_blob.MasterKey)
-            except OSError:
-                logger.warning("Unable to read unlock file: %s" % self._unlock_file)
+            master_key = self._read_unlock_file(self._unlock_file)
+            if master_key is not None:
+                self.db_key = self._find_wrapping_key(master_key)
 
     @property
     def db_key(self):
@@ -622,17 +1014,33 @@ class Chainbreaker(object):
     @db_key.setter
     def db_key(self, key):
         self._db_key = key
+        self._key_list = {}
 
         if self._db_key:
-            # Even after finding a db_key, we need to try and load the key list.
-            # If we don't find any keys, but we do find a db_key, then we've likely
-            # found a hash collision
-            if self._generate_key_list() > 0:
+            # Even after finding a db_key, we need to check that a symmetric key decrypts with it.
+            # If none does, but we do find a db_key, then we've likely found a hash collision.
+            # Keys are only decrypted up to the first one that does.
+            if any(self._get_symmetric_key(label) for label in self._get_symmetric_key_records()):
                 self.locked = False
 
+    # Select the crypto backend by name (see crypto_backend.backend_names()). Raises ValueError if the
+    # requested backend is not installed or fails its self-test.
+    @staticmethod
+    def set_crypto_backend(name=AUTO):
+        Chainbreaker.crypto_backend = select_backend(name)
+        return Chainbreaker.crypto_backend
+
+    @staticmethod
+    def get_crypto_backend():
+        if Chainbreaker.crypto_backend is None:
+            Chainbreaker.set_crypto_backend()
+        return Chainbreaker.crypto_backend
+
     # SOURCE : extractkeychain.py
+    # With verify=True the last block is decrypted and its padding checked first, and the rest of the data is
+    # only decrypted if that passes. Used where a wrong key is expected, so most of the work is skipped for it.
     @staticmethod
-    def _kcdecrypt(key, iv, data):
+    def _kcdecrypt(key, iv, data, verify=False):
         logger = logging.getLogger('Chainbreaker')
         if len(data) == 0:
             logger.debug("Encrypted data is 0.")
@@ -641,28 +1049,54 @@ class Chainbreaker(object):
         if len(data) % Chainbreaker.BLOCKSIZE != 0:
             return ''
 
-        cipher = TripleDES(key, CBC, str(bytearray(iv)))
+        backend = Chainbreaker.get_crypto_backend()
+        iv = str(bytearray(iv))
 
-        plain = cipher.decrypt(data)
+        if verify:
+            # In CBC the last plaintext block only depends on the last two ciphertext blocks
+            if len(data) > Chainbreaker.BLOCKSIZE:
+                chain = data[-2 * Chainbreaker.BLOCKSIZE:-Chainbreaker.BLOCKSIZE]
+            else:
+                chain = iv
+            tail = backend.decrypt(key, chain, data[-Chainbreaker.BLOCKSIZE:])
 
-        # now check padding
-        pad = ord(plain[-1])
-        if pad > 8:
-            logger.debug("Bad padding byte. Keychain password might be incorrect.")
+            if not Chainbreaker._has_valid_padding(tail):
+                Chainbreaker.verify_rejected += 1
+                logger.debug("Bad padding byte. Keychain password might be incorrect.")
+                return ''
+            Chainbreaker.verify_accepted += 1
+
+            plain = backend.decrypt(key, iv, data[:-Chainbreaker.BLOCKSIZE]) + tail
+        else:
+            plain = backend.decrypt(key, iv, data)
+
+        return Chainbreaker._strip_padding(plain)
+
+    # Removes the padding from a decrypted plaintext, or returns '' if it is not correctly padded.
+    @staticmethod
+    def _strip_padding(plain):
+        if not Chainbreaker._has_valid_padding(plain):
+            logging.getLogger('Chainbreaker').debug("Bad padding byte. Keychain password might be incorrect.")
             return ''
 
+        return plain[:-ord(plain[-1])]
+
+    # PKCS#7 style padding check: the last byte gives the pad length (1 - 8), and every pad byte holds it.
+    @staticmethod
+    def _has_valid_padding(plain):
+        pad = ord(plain[-1])
+        if pad == 0 or pad > Chainbreaker.BLOCKSIZE:
+            return False
+
         for z in plain[-pad:]:
             if ord(z) != pad:
-                logger.debug("Bad padding byte. Keychain password might be incorrect.")
-                return ''
-
-        plain = plain[:-pad]
+                return False
 
-        return plain
+        return True
 
     @staticmethod
     def _get_encrypted_data_in_blob(blob_buffer):
-        key_blob = _KEY_BLOB(blob_buffer[:_KEY_BLOB.STRUCT.size])
+        key_blob = _KEY_BLOB(blob_buffer)
 
         if key_blob.CommonBlob.Magic != _KEY_BLOB.COMMON_BLOB_MAGIC:
             return '', ''
@@ -684,7 +1118,7 @@ class Chainbreaker(object):
         logger = logging.getLogger('Chainbreaker')
 
         # magicCmsIV = unhexlify('4adda22c79e82105')
-        plain = Chainbreaker._kcdecrypt(dbkey, Chainbreaker.MAGIC_CMS_IV, encryptedblob)
+        plain = Chainbreaker._kcdecrypt(dbkey, Chainbreaker.MAGIC_CMS_IV, encryptedblob, verify=True)
 
         if plain.__len__() == 0:
             return ''
@@ -696,7 +1130,7 @@ class Chainbreaker(object):
             revplain += plain[31 - i]
 
         # now the real key gets found. */
-        plain = Chainbreaker._kcdecrypt(dbkey, iv, revplain)
+        plain = Chainbreaker._kcdecrypt(dbkey, iv, revplain, verify=True)
 
         keyblob = plain[4:]
 
@@ -707,8 +1141,9 @@ class Chainbreaker(object):
         return keyblob
 
     class KeychainRecord(object):
-        def __init__(self):
-            self.logger = logging.getLogger('Chainbreaker')
+        __slots__ = ()
+
+        logger = logging.getLogger('Chainbreaker')
 
         def write_to_disk(self, output_directory):
             # self.exportable contains the content we should write to disk. If it isn't implemented we can't
@@ -753,16 +1188,40 @@ class Chainbreaker(object):
         def FileExt(self):
             return '.txt'
 
+    # Base for records that keep the address and header of their record in the keychain, and decode each
+    # attribute the first time it is read. Subclasses list their attributes in ATTRIBUTE_READERS (see
+    # compile_attribute_readers) and add slots for _buffer, _base_addr and _header.
+    class LazyRecord(object):
+        __slots__ = ()
+
+        ATTRIBUTE_READERS = {}
+
+        def __init__(self, buffer, base_addr, header):
+            self._buffer = buffer
+            self._base_addr = base_addr
+            self._header = header
+
+        # Only called for attributes that are not set yet
+        def __getattr__(self, name):
+            try:
+                read = self.ATTRIBUTE_READERS[name]
+            except KeyError:
+                raise AttributeError(name)
+
+            value = read(self._buffer, self._base_addr, self._header)
+            setattr(self, name, value)
+            return value
+
     class KeychainPasswordHash(KeychainRecord):
         KEYCHAIN_PASSWORD_HASH_FORMAT = "$keychain$*%s*%s*%s"
 
+        __slots__ = ('salt', 'iv', 'cypher_text')
+
         def __init__(self, salt, iv, cyphertext):
             self.salt = salt
             self.iv = iv
             self.cypher_text = cyphertext
 
-            Chainbreaker.KeychainRecord.__init__(self)
-
         def __str__(self):
             return Chainbreaker.KeychainPasswordHash.KEYCHAIN_PASSWORD_HASH_FORMAT % (
                 self.salt, self.iv, self.cypher_text)
@@ -776,6 +1235,10 @@ class Chainbreaker(object):
             return "keychain_password_hash"
 
     class PublicKeyRecord(KeychainRecord):
+        __slots__ = (
+            'PrintName', 'Label', 'KeyClass', 'Private', 'KeyType', 'KeySize', 'EffectiveKeySize', 'Extracted',
+            'CSSMType', 'PublicKey', 'IV', 'Key')
+
         def __init__(self, print_name=None, label=None, key_class=None, private=None, key_type=None, key_size=None,
                      effective_key_size=None, extracted=None, cssm_type=None, public_key=None, iv=None, key=None):
             self.PrintName = print_name
@@ -791,8 +1254,6 @@ class Chainbreaker(object):
             self.IV = iv
             self.Key = key
 
-            Chainbreaker.KeychainRecord.__init__(self)
-
         def __str__(self):
             output = '[+] Public Key\n'
             output += ' [-] Print Name: %s\n' % self.PrintName
@@ -820,6 +1281,10 @@ class Chainbreaker(object):
             return '.pub'
 
     class PrivateKeyRecord(KeychainRecord):
+        __slots__ = (
+            'PrintName', 'Label', 'KeyClass', 'Private', 'KeyType', 'KeySize', 'EffectiveKeySize', 'Extracted',
+            'CSSMType', 'KeyName', 'PrivateKey', 'IV', 'Key')
+
         def __init__(self, print_name=None, label=None, key_class=None, private=None, key_type=None, key_size=None,
                      effective_key_size=None, extracted=None, cssm_type=None, key_name=None, private_key=None, iv=None,
                      key=None):
@@ -837,8 +1302,6 @@ class Chainbreaker(object):
             self.IV = iv
             self.Key = key
 
-            Chainbreaker.KeychainRecord.__init__(self)
-
         def __str__(self):
             output = '[+] Private Key\n'
             output += ' [-] Print Name: %s\n' % self.PrintName
@@ -873,6 +1336,10 @@ class Chainbreaker(object):
             return '.key'
 
     class X509CertificateRecord(KeychainRecord):
+        __slots__ = (
+            'Type', 'Encoding', 'PrintName', 'Alias', 'Subject', 'Issuer', 'Serial_Number', 'Subject_Key_Identifier',
+            'Public_Key_Hash', 'Certificate')
+
         def __init__(self, type=None, encoding=None, print_name=None, alias=None, subject=None, issuer=None,
                      serial_number=None, subject_key_identifier=None, public_key_hash=None, certificate=None):
             self.Type = type
@@ -886,8 +1353,6 @@ class Chainbreaker(object):
             self.Public_Key_Hash = public_key_hash
             self.Certificate = certificate
 
-            Chainbreaker.KeychainRecord.__init__(self)
-
         def __str__(self):
             output = '[+] X509 Certificate\n'
             # output += " [-] Type: %s\n" % self.Type
@@ -914,28 +1379,46 @@ class Chainbreaker(object):
         def FileExt(self):
             return '.crt'
 
+    class LazyX509CertificateRecord(LazyRecord, X509CertificateRecord):
+        __slots__ = ('_buffer', '_base_addr', '_header')
+
+        ATTRIBUTE_READERS = compile_attribute_readers(_X509_CERT_ATTRIBUTES, {
+            'serial_number': 'Serial_Number',
+            'subject_key_identifier': 'Subject_Key_Identifier',
+            'public_key_hash': 'Public_Key_Hash',
+        })
+
+        # The certificate follows the record header
+        ATTRIBUTE_READERS['Certificate'] = lambda buffer, base_addr, header: buffer[
+            base_addr + _X509_CERT_HEADER.STRUCT.size:base_addr + _X509_CERT_HEADER.STRUCT.size + header.CertSize]
+
     class SSGBEncryptedRecord(KeychainRecord):
+        __slots__ = ('_password', 'locked', 'password_b64_encoded')
+
         def __init__(self):
             self._password = None
             self.locked = True
             self.password_b64_encoded = False
 
-            Chainbreaker.KeychainRecord.__init__(self)
-
         def decrypt_password(self):
             try:
                 if self.SSGP and self.DBKey:
-                    self._password = Chainbreaker._kcdecrypt(self.DBKey, self.SSGP.IV, self.SSGP.EncryptedPassword)
-                    if not all(c in string.printable for c in self._password):
-                        self._password = base64.b64encode(self._password)
-                        self.password_b64_encoded = True
-                    self.locked = False
+                    self.set_password(
+                        Chainbreaker._kcdecrypt(self.DBKey, self.SSGP.IV, self.SSGP.EncryptedPassword))
             except KeyError:
                 if not self._password:
                     self.locked = True
                     self._password = None
             return self._password
 
+        # Stores a decrypted password, base64 encoding it if it isn't printable
+        def set_password(self, password):
+            self._password = password
+            if not all(c in string.printable for c in self._password):
+                self._password = base64.b64encode(self._password)
+                self.password_b64_encoded = True
+            self.locked = False
+
         def get_password_output_str(self):
             password = self.Password
             if self.password_b64_encoded:
@@ -965,6 +1448,10 @@ class Chainbreaker(object):
             return '.txt'
 
     class GenericPasswordRecord(SSGBEncryptedRecord):
+        __slots__ = (
+            'Created', 'LastModified', 'Description', 'Creator', 'Type', 'PrintName', 'Alias', 'Account', 'Service',
+            'Key', 'SSGP', 'DBKey')
+
         def __init__(self, created=None, last_modified=None, description=None, creator=None, type=None, print_name=None,
                      alias=None, account=None, service=None, key=None, ssgp=None, dbkey=None):
             self.Created = created
@@ -997,7 +1484,24 @@ class Chainbreaker(object):
 
             return output
 
+    class LazyGenericPasswordRecord(LazyRecord, GenericPasswordRecord):
+        __slots__ = ('_buffer', '_base_addr', '_header')
+
+        ATTRIBUTE_READERS = compile_attribute_readers(_GENERIC_PW_ATTRIBUTES)
+
+        def __init__(self, buffer, base_addr, header, ssgp=None, dbkey=None):
+            Chainbreaker.LazyRecord.__init__(self, buffer, base_addr, header)
+            self.Key = None
+            self.SSGP = ssgp
+            self.DBKey = dbkey
+
+            Chainbreaker.SSGBEncryptedRecord.__init__(self)
+
     class InternetPasswordRecord(SSGBEncryptedRecord):
+        __slots__ = (
+            'Created', 'LastModified', 'Description', 'Comment', 'Creator', 'Type', 'PrintName', 'Alias', 'Protected',
+            'Account', 'SecurityDomain', 'Server', 'ProtocolType', 'AuthType', 'Port', 'Path', 'SSGP', 'DBKey')
+
         def __init__(self, created=None, last_modified=None, description=None, comment=None, creator=None, type=None,
                      print_name=None, alias=None, protected=None, account=None, security_domain=None, server=None,
                      protocol_type=None, auth_type=None, port=None, path=None, ssgp=None, dbkey=None):
@@ -1054,7 +1558,23 @@ class Chainbreaker(object):
 
             return output
 
+    class LazyInternetPasswordRecord(LazyRecord, InternetPasswordRecord):
+        __slots__ = ('_buffer', '_base_addr', '_header')
+
+        ATTRIBUTE_READERS = compile_attribute_readers(_INTERNET_PW_ATTRIBUTES)
+
+        def __init__(self, buffer, base_addr, header, ssgp=None, dbkey=None):
+            Chainbreaker.LazyRecord.__init__(self, buffer, base_addr, header)
+            self.SSGP = ssgp
+            self.DBKey = dbkey
+
+            Chainbreaker.SSGBEncryptedRecord.__init__(self)
+
     class AppleshareRecord(SSGBEncryptedRecord):
+        __slots__ = (
+            'Created', 'LastModified', 'Description', 'Comment', 'Creator', 'Type', 'PrintName', 'Alias', 'Protected',
+            'Account', 'Volume', 'Server', 'Protocol_Type', 'Address', 'Signature', 'SSGP', 'DBKey')
+
         def __init__(self, created=None, last_modified=None, description=None, comment=None, creator=None, type=None,
                      print_name=None, alias=None, protected=None, account=None, volume=None, server=None,
                      protocol_type=None, address=None, signature=None, dbkey=None, ssgp=None):
@@ -1104,6 +1624,18 @@ class Chainbreaker(object):
 
             return output
 
+    class LazyAppleshareRecord(LazyRecord, AppleshareRecord):
+        __slots__ = ('_buffer', '_base_addr', '_header')
+
+        ATTRIBUTE_READERS = compile_attribute_readers(_APPLE_SHARE_ATTRIBUTES, {'protocol_type': 'Protocol_Type'})
+
+        def __init__(self, buffer, base_addr, header, ssgp=None, dbkey=None):
+            Chainbreaker.LazyRecord.__init__(self, buffer, base_addr, header)
+            self.SSGP = ssgp
+            self.DBKey = dbkey
+
+            Chainbreaker.SSGBEncryptedRecord.__init__(self)
+
 
 if __name__ == "__main__":
     import argparse
@@ -1112,6 +1644,7 @@ if __name__ == "__main__":
     import os
     import datetime
     import hashlib
+    import time
 
     arguments = argparse.ArgumentParser(description='Dump items stored in an OSX Keychain')
 
@@ -1180,10 +1713,33 @@ if __name__ == "__main__":
     unlock_args.add_argument('--key', help='Unlock the keychain with a key, provided via argument.'
                                            'Caution: This is insecure and you should likely use --key-prompt instead')
     unlock_args.add_argument('--unlock-file', help='Unlock the keychain with a key file')
+    unlock_args.add_argument('--wordlist', help='Try each line of this file as the unlock password, using a pool '
+                                                'of worker processes. Only use this on keychains you are '
+                                                'authorized to recover.')
+    unlock_args.add_argument('--wordlist-processes', type=int,
+                             help='Number of worker processes used by --wordlist. Defaults to one per CPU.')
+    unlock_args.add_argument('--wordlist-state',
+                             help='File the --wordlist progress is checkpointed to. Defaults to wordlist.state '
+                                  'in the output directory.')
+    unlock_args.add_argument('--resume', help='Resume the --wordlist run saved in the state file. The wordlist '
+                                              'is taken from the state file if --wordlist is not given.',
+                             action='store_const', dest='resume', const=True)
+
+    # Crypto arguments
+    crypto_args = arguments.add_argument_group('Crypto Options')
+    crypto_args.add_argument('--crypto-backend', choices=backend_names(),
+                             help='Crypto library used for 3DES and PBKDF2. By default the fastest installed '
+                                  'library that passes its self-test is used, falling back to the bundled '
+                                  'pure python implementation.')
 
     # Output arguments
     output_args = arguments.add_argument_group('Output Options')
     output_args.add_argument('--output', '-o', help='Directory to output exported records to.')
+    output_args.add_argument('--filter', dest='record_filter',
+                             help='Only dump or export records whose attributes match, e.g. '
+                                  '"service~=vpn,account=admin". Terms are comma separated and must all match: '
+                                  'name=value, name!=value, or name~=value for a case insensitive substring. '
+                                  'Records that don\'t match are skipped before they are decoded or decrypted.')
     output_args.add_argument('-d', '--debug', help="Print debug information", action="store_const", dest="loglevel",
                              const=logging.DEBUG)
 
@@ -1211,6 +1767,12 @@ if __name__ == "__main__":
         password=None,
         key=None,
         unlock_file=None,
+        wordlist=None,
+        wordlist_processes=None,
+        wordlist_state=None,
+        resume=False,
+        record_filter=None,
+        crypto_backend=AUTO,
     )
 
     args = arguments.parse_args()
@@ -1260,6 +1822,20 @@ if __name__ == "__main__":
         logger.critical("No action specified.")
         exit(1)
 
+    record_filter = None
+    if args.record_filter:
+        try:
+            record_filter = RecordFilter(args.record_filter)
+        except ValueError as e:
+            logger.critical("Invalid filter: %s" % e)
+            exit(1)
+
+    try:
+        crypto_backend = Chainbreaker.set_crypto_backend(args.crypto_backend)
+    except ValueError as e:
+        logger.critical(e)
+        exit(1)
+
     # Calculate the MD5 and SHA256 of the input keychain file.
     keychain_md5 = hashlib.md5(args.keychain).hexdigest()
     keychain_sha256 = hashlib.sha256(args.keychain).hexdigest()
@@ -1271,18 +1847,62 @@ if __name__ == "__main__":
         "Keychain: %s" % args.keychain,
         "Keychain MD5: %s" % keychain_md5,
         "Keychain 256: %s" % keychain_sha256,
+        "Crypto Backend: %s" % crypto_backend.name,
         "Dump Start: %s" % datetime.datetime.now(),
     ]
 
+    if record_filter is not None:
+        summary_output.insert(-1, "Filter: %s" % record_filter)
+
     for line in summary_output:
         logger.info(line)
 
     summary_output.append("Dump Summary:")
 
+    # Checking unlock options needs neither the records nor an unlocked keychain
+    if args.check_unlock and not (args.wordlist or args.resume):
+        keychain = Chainbreaker(args.keychain)
+
+        verify_start = time.time()
+        unlocked = keychain.check_unlock_options(unlock_password=args.password, unlock_key=args.key,
+                                                 unlock_file=args.unlock_file)
+        logger.info("Unlock verification took %.3f seconds" % (time.time() - verify_start))
+
+        if unlocked:
+            logger.info("Keychain Unlock Successful.")
+            exit(0)
+        else:
+            logger.info("Invalid Unlock Options")
+            exit(1)
+
     # Done parsing out input options, now actually do the work.
     keychain = Chainbreaker(args.keychain, unlock_password=args.password, unlock_key=args.key,
                             unlock_file=args.unlock_file)
 
+    if (args.wordlist or args.resume) and keychain.locked:
+        from wordlist import WordlistSearch
+
+        search = WordlistSearch(keychain, args.wordlist, processes=args.wordlist_processes,
+                                state_file=args.wordlist_state or os.path.join(args.output, 'wordlist.state'))
+        try:
+            if args.resume:
+                search.resume()
+            password = search.run()
+        except IOError as e:
+            logger.critical("Unable to read wordlist: %s" % e)
+            exit(1)
+        except ValueError as e:
+            logger.critical("Unable to resume wordlist: %s" % e)
+            exit(1)
+        except KeyboardInterrupt:
+            logger.info("Wordlist interrupted, progress saved to %s" % search.state_file)
+            exit(1)
+
+        if password is None:
+            logger.info("Password not found in wordlist")
+        else:
+            logger.info("Password found in wordlist: %s" % password)
+
     if args.check_unlock:
         if keychain.locked:
             logger.info("Invalid Unlock Options")
@@ -1308,7 +1928,7 @@ if __name__ == "__main__":
         output.append(
             {
                 'header': 'Generic Passwords',
-                'records': keychain.dump_generic_passwords(),
+                'records': keychain.iter_decrypted_passwords(keychain.iter_generic_passwords(record_filter)),
                 'write_to_console': args.dump_generic_passwords,
                 'write_to_disk': args.export_generic_passwords,
                 'write_directory': os.path.join(args.output, 'passwords', 'generic')
@@ -1318,7 +1938,7 @@ if __name__ == "__main__":
         output.append(
             {
                 'header': 'Internet Passwords',
-                'records': keychain.dump_internet_passwords(),
+                'records': keychain.iter_decrypted_passwords(keychain.iter_internet_passwords(record_filter)),
                 'write_to_console': args.dump_internet_passwords,
                 'write_to_disk': args.export_internet_passwords,
                 'write_directory': os.path.join(args.output, 'passwords', 'internet')
@@ -1328,7 +1948,7 @@ if __name__ == "__main__":
         output.append(
             {
                 'header': 'Appleshare Passwords',
-                'records': keychain.dump_appleshare_passwords(),
+                'records': keychain.iter_decrypted_passwords(keychain.iter_appleshare_passwords(record_filter)),
                 'write_to_console': args.dump_appleshare_passwords,
                 'write_to_disk': args.export_appleshare_passwords,
                 'write_directory': os.path.join(args.output, 'passwords', 'appleshare')
@@ -1338,7 +1958,7 @@ if __name__ == "__main__":
         output.append(
             {
                 'header': 'Private Keys',
-                'records': keychain.dump_private_keys(),
+                'records': keychain.iter_private_keys(record_filter),
                 'write_to_console': args.dump_private_keys,
                 'write_to_disk': args.export_private_keys,
                 'write_directory': os.path.join(args.output, 'keys', 'private')
@@ -1348,7 +1968,7 @@ if __name__ == "__main__":
         output.append(
             {
                 'header': 'Public Keys',
-                'records': keychain.dump_public_keys(),
+                'records': keychain.iter_public_keys(record_filter),
                 'write_to_console': args.dump_public_keys,
                 'write_to_disk': args.export_public_keys,
                 'write_directory': os.path.join(args.output, 'keys', 'public')
@@ -1358,7 +1978,7 @@ if __name__ == "__main__":
         output.append(
             {
                 'header': 'x509 Certificates',
-                'records': keychain.dump_x509_certificates(),
+                'records': keychain.iter_x509_certificates(record_filter),
                 'write_to_console': args.dump_x509_certificates,
                 'write_to_disk': args.export_x509_certificates,
                 'write_directory': os.path.join(args.output, 'certificates')
@@ -1368,13 +1988,13 @@ if __name__ == "__main__":
     try:
         for record_collection in output:
             if 'records' in record_collection:
-                number_records = len(record_collection['records'])
-                collection_summary = "%s %s" % (len(record_collection['records']), record_collection['header'])
-                logger.info(collection_summary)
-
-                summary_output.append("\t%s" % collection_summary)
+                # Records are written out as they are read from the keychain, so they are only counted for the
+                # dump summary once the section is done
+                logger.info(record_collection['header'])
 
+                number_records = 0
                 for record in record_collection['records']:
+                    number_records += 1
                     if record_collection.get('write_to_console', False):
                         for line in str(record).split('\n'):
                             logger.info("\t%s" % line)
@@ -1382,8 +2002,17 @@ if __name__ == "__main__":
                         record.write_to_disk(record_collection.get('write_directory', args.output))
                     logger.info("")
 
+                summary_output.append("\t%s %s" % (number_records, record_collection['header']))
+
         summary_output.append("Dump End: %s" % datetime.datetime.now())
 
+        logger.debug("Key schedule cache: %d hits, %d misses" % (Chainbreaker.key_schedule_cache.hits,
+                                                                 Chainbreaker.key_schedule_cache.misses))
+        logger.debug("Padding pre-check: %d accepted, %d rejected" % (Chainbreaker.verify_accepted,
+                                                                       Chainbreaker.verify_rejected))
+        logger.debug("Attribute lookups: %d from table indexes, %d by scanning" % (Chainbreaker.disk_index_lookups,
+                                                                                  Chainbreaker.scan_lookups))
+
         if any(x.get('write_to_disk', False) for x in output):
             with open(os.path.join(args.output, "summary.txt"), 'w') as summary_fp:
                 for line in summary_output:
@@ -1395,6 +2024,8 @@ if __name__ == "__main__":
 
     except KeyboardInterrupt:
         exit(0)
+    finally:
+        keychain.close()
 
     exit(0)
 
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+
+# Pluggable crypto backends for Chainbreaker.
+#
+# Keychain unlocking needs two primitives: 3DES in CBC mode and PBKDF2 with
+# HMAC-SHA1. Both have a pure python implementation bundled with Chainbreaker
+# (pyDes and pbkdf2), which always works but is slow. When an optional
+# accelerated library is installed it is registered here as well and picked
+# automatically, after passing a known-answer self-test.
+
+from abc import ABCMeta, abstractmethod
+from binascii import unhexlify
+from collections import OrderedDict
+import logging
+
+from pyDes import KeyScheduleCache
+from pbkdf2 import derive
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers import Cipher, modes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+    try:
+        # TripleDES moved here in newer releases of cryptography
+        from cryptography.hazmat.decrepit.ciphers.algorithms import TripleDES as _CryptographyTripleDES
+    except ImportError:
+        from cryptography.hazmat.primitives.ciphers.algorithms import TripleDES as _CryptographyTripleDES
+except ImportError:
+    Cipher = None
+
+try:
+    from Crypto.Cipher import DES3
+except ImportError:
+    DES3 = None
+
+AUTO = 'auto'
+
+# Registered providers, in order of preference
+CIPHERS = OrderedDict()
+KDFS = OrderedDict()
+
+
+def register_cipher(cls):
+    CIPHERS[cls.NAME] = cls
+    return cls
+
+
+def register_kdf(cls):
+    KDFS[cls.NAME] = cls
+    return cls
+
+
+# Providers subclass CipherProvider or KDFProvider, set NAME, implement the abstract method, and override
+# is_available() if they depend on an optional library.
+class CipherProvider(object):
+    __metaclass__ = ABCMeta
+
+    NAME = None
+
+    # NIST SP 800-67 key and plaintext, encrypted in CBC mode under SELF_TEST_IV
+    SELF_TEST_KEY = unhexlify('0123456789ABCDEF23456789ABCDEF01456789ABCDEF0123')
+    SELF_TEST_IV = unhexlify('F69F2445DF4F9B17')
+    SELF_TEST_CIPHERTEXT = unhexlify('a5c282bad0de3774becd2e04386b589fb5057d8552fc4336')
+    SELF_TEST_PLAINTEXT = 'The qufck brown fox jump'
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    # Returns the raw 3DES-CBC decryption of data, padding is left in place.
+    @abstractmethod
+    def decrypt(self, key, iv, data):
+        pass
+
+    # Decrypts a list of (iv, data) pairs that share one key, returning the raw plaintexts in the same order.
+    def decrypt_many(self, key, items):
+        return [self.decrypt(key, iv, data) for iv, data in items]
+
+    def self_test(self):
+        return self.decrypt(self.SELF_TEST_KEY, self.SELF_TEST_IV,
+                            self.SELF_TEST_CIPHERTEXT) == self.SELF_TEST_PLAINTEXT
+
+
+class KDFProvider(object):
+    __metaclass__ = ABCMeta
+
+    NAME = None
+
+    # Test vector from RFC 3211
+    SELF_TEST_PASSWORD = 'All n-entities must communicate with other n-entities via n-1 entiteeheehees'
+    SELF_TEST_SALT = unhexlify('1234567878563412')
+    SELF_TEST_ITERATIONS = 500
+    SELF_TEST_KEY = unhexlify('6a8970bf68c92caea84a8df285108586')
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    # Returns keylen bytes of PBKDF2-HMAC-SHA1 output.
+    @abstractmethod
+    def pbkdf2(self, password, salt, iterations, keylen):
+        pass
+
+    def self_test(self):
+        return self.pbkdf2(self.SELF_TEST_PASSWORD, self.SELF_TEST_SALT, self.SELF_TEST_ITERATIONS,
+                           len(self.SELF_TEST_KEY)) == self.SELF_TEST_KEY
+
+
+@register_cipher
+class CryptographyCipher(CipherProvider):
+    NAME = 'cryptography'
+
+    @classmethod
+    def is_available(cls):
+        return Cipher is not None
+
+    def decrypt(self, key, iv, data):
+        decryptor = Cipher(_CryptographyTripleDES(key), modes.CBC(iv), backend=default_backend()).decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+
+
+@register_cipher
+class PyCryptodomeCipher(CipherProvider):
+    NAME = 'pycryptodome'
+
+    @classmethod
+    def is_available(cls):
+        return DES3 is not None
+
+    def decrypt(self, key, iv, data):
+        try:
+            return DES3.new(key, DES3.MODE_CBC, iv).decrypt(data)
+        except ValueError:
+            # pycryptodome refuses keys that degenerate to single DES, pyDes does not
+            return BuiltinCipher().decrypt(key, iv, data)
+
+
+@register_cipher
+class BuiltinCipher(CipherProvider):
+    NAME = 'builtin'
+
+    # Expanded 3DES key schedules, shared by every record decrypted under the db key or a key_list key
+    key_schedule_cache = KeyScheduleCache(maxsize=64)
+
+    def decrypt(self, key, iv, data):
+        return BuiltinCipher.key_schedule_cache.get(key).decrypt(data, IV=iv)
+
+    def decrypt_many(self, key, items):
+        cipher = BuiltinCipher.key_schedule_cache.get(key)
+        return [cipher.decrypt(data, IV=iv) for iv, data in items]
+
+
+@register_kdf
+class CryptographyKDF(KDFProvider):
+    NAME = 'cryptography'
+
+    @classmethod
+    def is_available(cls):
+        return Cipher is not None
+
+    def pbkdf2(self, password, salt, iterations, keylen):
+        return PBKDF2HMAC(algorithm=hashes.SHA1(), length=keylen, salt=salt, iterations=iterations,
+                          backend=default_backend()).derive(password)
+
+
+@register_kdf
+class BuiltinKDF(KDFProvider):
+    NAME = 'builtin'
+
+    def pbkdf2(self, password, salt, iterations, keylen):
+        return derive(password, salt, iterations, keylen)
+
+
+class CryptoBackend(object):
+    def __init__(self, cipher, kdf):
+        self.cipher = cipher
+        self.kdf = kdf
+
+    @property
+    def name(self):
+        if self.cipher.NAME == self.kdf.NAME:
+            return self.cipher.NAME
+        return '%s (3DES), %s (PBKDF2)' % (self.cipher.NAME, self.kdf.NAME)
+
+    def decrypt(self, key, iv, data):
+        return self.cipher.decrypt(key, iv, data)
+
+    def decrypt_many(self, key, items):
+        return self.cipher.decrypt_many(key, items)
+
+    def pbkdf2(self, password, salt, iterations, keylen):
+        return self.kdf.pbkdf2(password, salt, iterations, keylen)
+
+
+def backend_names():
+    return [AUTO] + list(OrderedDict.fromkeys(list(CIPHERS) + list(KDFS)))
+
+
+# Instantiate the first usable provider out of registry, or the one called name if a choice was forced.
+def _select_provider(registry, name, kind):
+    logger = logging.getLogger('Chainbreaker')
+
+    if name == AUTO or name not in registry:
+        candidates = registry.values()
+    else:
+        candidates = [registry[name]]
+
+    for provider_class in candidates:
+        if not provider_class.is_available():
+            logger.debug('%s backend %s is not installed' % (kind, provider_class.NAME))
+            continue
+
+        provider = provider_class()
+        try:
+            passed = provider.self_test()
+        except Exception as e:
+            logger.debug('%s backend %s raised during self-test: %s' % (kind, provider_class.NAME, e))
+            passed = False
+
+        if passed:
+            return provider
+        logger.warning('%s backend %s failed its self-test' % (kind, provider_class.NAME))
+
+    raise ValueError('No usable %s backend (requested: %s)' % (kind, name))
+
+
+# Returns a CryptoBackend. With name 'auto' the fastest available providers are chosen; otherwise the named
+# provider is used for every primitive it implements, falling back to 'auto' for the rest.
+def select_backend(name=AUTO):
+    if name not in backend_names():
+        raise ValueError('Unknown crypto backend: %s' % name)
+
+    return CryptoBackend(_select_provider(CIPHERS, name, '3DES'), _select_provider(KDFS, name, 'PBKDF2'))
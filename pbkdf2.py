@@ -15,60 +15,65 @@ import hmac
 from binascii import hexlify, unhexlify
 from struct import pack
 
+try:
+    # Python 2.7.8+ and 3.4+
+    from hashlib import pbkdf2_hmac
+except ImportError:
+    pbkdf2_hmac = None
 
-class PBKDF2(object):
-    BLOCKLEN = 20
+BLOCKLEN = 20
+
+
+# Derives keylen bytes from password and salt. This is what you want to call.
+def derive(password, salt, iterations, keylen, hashfn=sha1):
+    if pbkdf2_hmac is not None:
+        return pbkdf2_hmac(hashfn().name, password, salt, iterations, keylen)
+    return _derive(password, salt, iterations, keylen, hashfn)
 
-    # this is what you want to call.
-    def __init__(self, password, salt, itercount, keylen, hashfn=sha1):
-        self.password = password
-        self.salt = salt
-        self.itercount = itercount
-        self.keylen = keylen
-        self.hashfn = hashfn
 
-        # l - number of output blocks to produce
-        l = self.keylen / PBKDF2.BLOCKLEN
-        if self.keylen % PBKDF2.BLOCKLEN != 0:
-            l += 1
+# Pure python version of derive(), for when hashlib has no pbkdf2_hmac
+def _derive(password, salt, iterations, keylen, hashfn=sha1):
+    h = hmac.new(password, None, hashfn)
+    blocklen = h.digest_size
 
-        h = hmac.new(self.password, None, self.hashfn)
+    # number of output blocks to produce
+    l = (keylen + blocklen - 1) // blocklen
 
-        T = ""
-        for i in range(1, l + 1):
-            T += PBKDF2._pbkdf2_f(h, self.salt, self.itercount, i)
+    T = b''.join(_pbkdf2_f(h, salt, iterations, i) for i in range(1, l + 1))
+    return T[:keylen]
 
-        self.key = T[: -(PBKDF2.BLOCKLEN - self.keylen % PBKDF2.BLOCKLEN)]
 
-    @staticmethod
-    def _xorstr(a, b):
-        if len(a) != len(b):
-            raise Exception("xorstr(): lengths differ")
+def _prf(h, data):
+    hm = h.copy()
+    hm.update(data)
+    return hm.digest()
 
-        ret = ''
-        for i in range(len(a)):
-            ret += chr(ord(a[i]) ^ ord(b[i]))
 
-        return ret
+# Helper as per the spec. h is a hmac which has been created seeded with the
+# password, it will be copy()ed and not modified. The running xor is kept as one
+# integer rather than xoring the digests byte by byte.
+def _pbkdf2_f(h, salt, itercount, blocknum):
+    U = _prf(h, salt + pack('>i', blocknum))
+    T = int(hexlify(U), 16)
 
-    @staticmethod
-    def _prf(h, data):
-        hm = h.copy()
-        hm.update(data)
-        return hm.digest()
+    for i in range(2, itercount + 1):
+        U = _prf(h, U)
+        T ^= int(hexlify(U), 16)
 
-    # Helper as per the spec. h is a hmac which has been created seeded with the
-    # password, it will be copy()ed and not modified.
-    @staticmethod
-    def _pbkdf2_f(h, salt, itercount, blocknum):
-        U = PBKDF2._prf(h, salt + pack('>i', blocknum))
-        T = U
+    return unhexlify('%0*x' % (2 * len(U), T))
 
-        for i in range(2, itercount + 1):
-            U = PBKDF2._prf(h, U)
-            T = PBKDF2._xorstr(T, U)
 
-        return T
+class PBKDF2(object):
+    BLOCKLEN = BLOCKLEN
+
+    def __init__(self, password, salt, itercount, keylen, hashfn=sha1):
+        self.password = password
+        self.salt = salt
+        self.itercount = itercount
+        self.keylen = keylen
+        self.hashfn = hashfn
+
+        self.key = derive(self.password, self.salt, self.itercount, self.keylen, self.hashfn)
 
     def __repr__(self):
         return self.key
@@ -84,9 +89,14 @@ def test():
     password = 'All n-entities must communicate with other n-entities via n-1 entiteeheehees'
     itercount = 500
     keylen = 16
-    ret = PBKDF2(password, salt, itercount, keylen)
-    print("key:      %s" % hexlify(str(ret)))
-    print("expected: 6A 89 70 BF 68 C9 2C AE A8 4A 8D F2 85 10 85 86")
+    expected = unhexlify('6a8970bf68c92caea84a8df285108586')
+
+    for name, fn in (('derive', derive), ('fallback', _derive)):
+        ret = fn(password, salt, itercount, keylen)
+        print("%-9s key:      %s" % (name, hexlify(ret)))
+        print("%-9s expected: %s" % (name, hexlify(expected)))
+        if ret != expected:
+            raise AssertionError("%s does not match the RFC 3211 test vector" % name)
 
 
 if __name__ == '__main__':
@@ -52,10 +52,16 @@ Note: This code was not written for high-end systems needing a fast
 
 """
 
+import struct
+from collections import OrderedDict
+
 # Modes of crypting / cyphering
 ECB = 0
 CBC = 1
 
+# A block as a 64-bit big endian integer
+_BLOCK = struct.Struct('>Q')
+
 
 #############################################################################
 # 				    DES					    #
@@ -187,10 +193,22 @@ class DES(object):
     ENCRYPT = 0x00
     DECRYPT = 0x01
 
+    # Lookup tables derived from the permutations and S-boxes above. They are
+    # built once, the first time a DES object is created:
+    #   __sp       - 8 tables of 64 entries, S-box j followed by the P permutation
+    #   __ip_bytes - 8 tables of 256 entries, IP applied to one byte of the block
+    #   __fp_bytes - 8 tables of 256 entries, FP applied to one byte of the block
+    __sp = None
+    __ip_bytes = None
+    __fp_bytes = None
+
     # Initialisation
     def __init__(self, key, mode=ECB, IV=None):
         if len(key) != 8:
             raise ValueError("Invalid DES key size. Key must be exactly 8 bytes long.")
+        if DES.__sp is None:
+            DES.__build_tables()
+
         self.block_size = 8
         self.key_size = 8
         self.__padding = ''
@@ -200,10 +218,8 @@ class DES(object):
         if IV:
             self.setIV(IV)
 
-        self.L = []
-        self.R = []
-        self.Kn = [[0] * 48] * 16  # 16 48-bit keys (K1 - K16)
-        self.final = []
+        self.Kn = []  # 16 subkeys (K1 - K16), each split into eight 6-bit values
+        self.Kn_reversed = []  # Kn in decryption order (K16 - K1)
 
         self.setKey(key)
 
@@ -238,146 +254,127 @@ class DES(object):
         """getPadding() -> string of length 1. Padding character."""
         return self.__padding
 
-    def __String_to_BitList(self, data):
-        """Turn the string data, into a list of bits (1, 0)'s"""
-        l = len(data) * 8
-        result = [0] * l
-        pos = 0
-        for c in data:
-            i = 7
-            ch = ord(c)
-            while i >= 0:
-                if ch & (1 << i) != 0:
-                    result[pos] = 1
-                else:
-                    result[pos] = 0
-                pos += 1
-                i -= 1
-
-        return result
-
-    def __BitList_to_String(self, data):
-        """Turn the list of bits -> data, into a string"""
-        result = ''
-        pos = 0
-        c = 0
-        while pos < len(data):
-            c += data[pos] << (7 - (pos % 8))
-            if (pos % 8) == 7:
-                result += chr(c)
-                c = 0
-            pos += 1
-
-        return result
-
-    def __permutate(self, table, block):
-        """Permutate this block with the specified table"""
-        return map(lambda x: block[x], table)
+    @staticmethod
+    def __byte_tables(table):
+        """Split a 64-bit permutation into 8 lookup tables, one per input byte"""
+        tables = []
+        for byte in range(8):
+            # Output bits contributed by each bit of this input byte
+            masks = [0] * 8
+            for i, src in enumerate(table):
+                if src >> 3 == byte:
+                    masks[src & 7] |= 1 << (63 - i)
+
+            lookup = []
+            for value in range(256):
+                out = 0
+                for bit in range(8):
+                    if value & (0x80 >> bit):
+                        out |= masks[bit]
+                lookup.append(out)
+            tables.append(lookup)
+
+        return tables
+
+    @staticmethod
+    def __build_tables():
+        """Precompute the SP, IP and FP lookup tables shared by all DES objects"""
+        sp = []
+        for j in range(8):
+            lookup = []
+            for six in range(64):
+                # Row is the outer two bits, column the inner four
+                v = DES.__sbox[j][(six & 0x20) | ((six & 1) << 4) | ((six >> 1) & 0xf)]
+                out = 0
+                for i, src in enumerate(DES.__p):
+                    if src >> 2 == j and v & (8 >> (src & 3)):
+                        out |= 1 << (31 - i)
+                lookup.append(out)
+            sp.append(lookup)
+
+        DES.__ip_bytes = DES.__byte_tables(DES.__ip)
+        DES.__fp_bytes = DES.__byte_tables(DES.__fp)
+        DES.__sp = sp
 
     # Transform the secret key, so that it is ready for data processing
     # Create the 16 subkeys, K[1] - K[16]
     def __create_sub_keys(self):
         """Create the 16 subkeys K[1] to K[16] from the given key"""
-        key = self.__permutate(DES.__pc1, self.__String_to_BitList(self.getKey()))
-        i = 0
-        # Split into Left and Right sections
-        self.L = key[:28]
-        self.R = key[28:]
-        while i < 16:
-            j = 0
-            # Perform circular left shifts
-            while j < DES.__left_rotations[i]:
-                self.L.append(self.L[0])
-                del self.L[0]
+        key = struct.unpack('>Q', self.getKey())[0]
 
-                self.R.append(self.R[0])
-                del self.R[0]
+        cd = 0
+        for i, src in enumerate(DES.__pc1):
+            if (key >> (63 - src)) & 1:
+                cd |= 1 << (55 - i)
 
-                j += 1
+        # Split into Left and Right sections
+        c = cd >> 28
+        d = cd & 0xfffffff
+
+        self.Kn = []
+        for rotations in DES.__left_rotations:
+            # Perform circular left shifts
+            c = ((c << rotations) | (c >> (28 - rotations))) & 0xfffffff
+            d = ((d << rotations) | (d >> (28 - rotations))) & 0xfffffff
+            cd = (c << 28) | d
 
             # Create one of the 16 subkeys through pc2 permutation
-            self.Kn[i] = self.__permutate(DES.__pc2, self.L + self.R)
+            k = 0
+            for i, src in enumerate(DES.__pc2):
+                if (cd >> (55 - src)) & 1:
+                    k |= 1 << (47 - i)
 
-            i += 1
+            # Store it pre-split into the 6-bit groups fed to each S-box
+            self.Kn.append(tuple((k >> (42 - 6 * j)) & 0x3f for j in range(8)))
+
+        self.Kn_reversed = self.Kn[::-1]
 
     # Main part of the encryption algorithm, the number cruncher :)
     def __des_crypt(self, block, crypt_type):
-        """Crypt the block of data through DES bit-manipulation"""
-        block = self.__permutate(DES.__ip, block)
-        self.L = block[:32]
-        self.R = block[32:]
+        """Crypt a 64-bit integer block through the DES rounds"""
+        ip = DES.__ip_bytes
+        block = (ip[0][block >> 56] | ip[1][(block >> 48) & 0xff] | ip[2][(block >> 40) & 0xff] |
+                 ip[3][(block >> 32) & 0xff] | ip[4][(block >> 24) & 0xff] | ip[5][(block >> 16) & 0xff] |
+                 ip[6][(block >> 8) & 0xff] | ip[7][block & 0xff])
+        L = block >> 32
+        R = block & 0xffffffff
 
         # Encryption starts from Kn[1] through to Kn[16]
-        if crypt_type == DES.ENCRYPT:
-            iteration = 0
-            iteration_adjustment = 1
         # Decryption starts from Kn[16] down to Kn[1]
+        if crypt_type == DES.ENCRYPT:
+            subkeys = self.Kn
         else:
-            iteration = 15
-            iteration_adjustment = -1
-
-        i = 0
-        while i < 16:
-            # Make a copy of R[i-1], this will later become L[i]
-            tempR = self.R[:]
-
-            # Permutate R[i - 1] to start creating R[i]
-            self.R = self.__permutate(DES.__expansion_table, self.R)
-
-            # Exclusive or R[i - 1] with K[i], create B[1] to B[8] whilst here
-            self.R = map(lambda x, y: x ^ y, self.R, self.Kn[iteration])
-            B = [self.R[:6], self.R[6:12], self.R[12:18], self.R[18:24], self.R[24:30], self.R[30:36], self.R[36:42],
-                 self.R[42:]]
-            # Optimization: Replaced below commented code with above
-            # j = 0
-            # B = []
-            # while j < len(self.R):
-            #	self.R[j] = self.R[j] ^ self.Kn[iteration][j]
-            #	j += 1
-            #	if j % 6 == 0:
-            #		B.append(self.R[j-6:j])
-
-            # Permutate B[1] to B[8] using the S-Boxes
-            j = 0
-            Bn = [0] * 32
-            pos = 0
-            while j < 8:
-                # Work out the offsets
-                m = (B[j][0] << 1) + B[j][5]
-                n = (B[j][1] << 3) + (B[j][2] << 2) + (B[j][3] << 1) + B[j][4]
-
-                # Find the permutation value
-                v = DES.__sbox[j][(m << 4) + n]
-
-                # Turn value into bits, add it to result: Bn
-                Bn[pos] = (v & 8) >> 3
-                Bn[pos + 1] = (v & 4) >> 2
-                Bn[pos + 2] = (v & 2) >> 1
-                Bn[pos + 3] = v & 1
-
-                pos += 4
-                j += 1
-
-            # Permutate the concatination of B[1] to B[8] (Bn)
-            self.R = self.__permutate(DES.__p, Bn)
-
-            # Xor with L[i - 1]
-            self.R = map(lambda x, y: x ^ y, self.R, self.L)
-            # Optimization: This now replaces the below commented code
-            # j = 0
-            # while j < len(self.R):
-            #	self.R[j] = self.R[j] ^ self.L[j]
-            #	j += 1
-
-            # L[i] becomes R[i - 1]
-            self.L = tempR
-
-            i += 1
-            iteration += iteration_adjustment
+            subkeys = self.Kn_reversed
+
+        sp0, sp1, sp2, sp3, sp4, sp5, sp6, sp7 = DES.__sp
+        for k0, k1, k2, k3, k4, k5, k6, k7 in subkeys:
+            # The expansion table picks overlapping 6-bit windows of R[i - 1],
+            # each of which is xored with its part of K[i] and sent through the
+            # combined S-box and P permutation.
+            L, R = R, L ^ (sp0[(((R & 1) << 5) | (R >> 27)) ^ k0] |
+                           sp1[((R >> 23) & 0x3f) ^ k1] |
+                           sp2[((R >> 19) & 0x3f) ^ k2] |
+                           sp3[((R >> 15) & 0x3f) ^ k3] |
+                           sp4[((R >> 11) & 0x3f) ^ k4] |
+                           sp5[((R >> 7) & 0x3f) ^ k5] |
+                           sp6[((R >> 3) & 0x3f) ^ k6] |
+                           sp7[(((R & 0x1f) << 1) | (R >> 31)) ^ k7])
 
         # Final permutation of R[16]L[16]
-        self.final = self.__permutate(DES.__fp, self.R + self.L)
-        return self.final
+        block = (R << 32) | L
+        fp = DES.__fp_bytes
+        return (fp[0][block >> 56] | fp[1][(block >> 48) & 0xff] | fp[2][(block >> 40) & 0xff] |
+                fp[3][(block >> 32) & 0xff] | fp[4][(block >> 24) & 0xff] | fp[5][(block >> 16) & 0xff] |
+                fp[6][(block >> 8) & 0xff] | fp[7][block & 0xff])
+
+    def crypt_block(self, block, crypt_type):
+        """
+        crypt_block(block, crypt_type) -> integer
+
+        Crypt a single block, given as a 64-bit big endian integer. No mode
+        or padding is applied, this is the raw DES primitive.
+        """
+        return self.__des_crypt(block, crypt_type)
 
     # Data to be encrypted/decrypted
     def crypt(self, data, crypt_type):
@@ -395,74 +392,41 @@ class DES(object):
                     self.block_size) + " bytes\n. Try setting the optional padding character")
             else:
                 data += (self.block_size - (len(data) % self.block_size)) * self.getPadding()
-            # print("Len of data: %f" % (len(data) / self.block_size))
 
-        if self.getMode() == CBC:
+        cbc = self.getMode() == CBC
+        if cbc:
             if self.getIV():
-                iv = self.__String_to_BitList(self.getIV())
+                iv = struct.unpack('>Q', self.getIV())[0]
             else:
                 raise ValueError("For CBC mode, you must supply the Initial Value (IV) for ciphering")
 
-        # Split the data into blocks, crypting each one seperately
-        i = 0
-        dict = {}
+        # Split the data into 64-bit blocks, crypting each one seperately
+        count = len(data) // self.block_size
+        blocks = struct.unpack('>%dQ' % count, data)
         result = []
-        # cached = 0
-        # lines = 0
-        while i < len(data):
-            # Test code for caching encryption results
-            # lines += 1
-            # if dict.has_key(data[i:i+8]):
-            # print("Cached result for: %s" % data[i:i+8])
-            #	cached += 1
-            #	result.append(dict[data[i:i+8]])
-            #	i += 8
-            #	continue
-
-            block = self.__String_to_BitList(data[i:i + 8])
-
+        for block in blocks:
             # Xor with IV if using CBC mode
-            if self.getMode() == CBC:
+            if cbc:
                 if crypt_type == DES.ENCRYPT:
-                    block = map(lambda x, y: x ^ y, block, iv)
-                # j = 0
-                # while j < len(block):
-                #	block[j] = block[j] ^ iv[j]
-                #	j += 1
-
-                processed_block = self.__des_crypt(block, crypt_type)
-
-                if crypt_type == DES.DECRYPT:
-                    processed_block = map(lambda x, y: x ^ y, processed_block, iv)
-                    # j = 0
-                    # while j < len(processed_block):
-                    #	processed_block[j] = processed_block[j] ^ iv[j]
-                    #	j += 1
-                    iv = block
+                    iv = self.__des_crypt(block ^ iv, crypt_type)
+                    result.append(iv)
                 else:
-                    iv = processed_block
+                    result.append(self.__des_crypt(block, crypt_type) ^ iv)
+                    iv = block
             else:
-                processed_block = self.__des_crypt(block, crypt_type)
+                result.append(self.__des_crypt(block, crypt_type))
 
-            # Add the resulting crypted block to our list
-            # d = self.__BitList_to_String(processed_block)
-            # result.append(d)
-            result.append(self.__BitList_to_String(processed_block))
-            # dict[data[i:i+8]] = d
-            i += 8
-
-        # print("Lines: %d, cached: %d" % (lines, cached))
+        result = struct.pack('>%dQ' % count, *result)
 
         # Remove the padding from the last block
         if crypt_type == DES.DECRYPT and self.getPadding():
-            # print("Removing decrypt pad")
-            s = result[-1]
-            while s[-1] == self.getPadding():
-                s = s[:-1]
-            result[-1] = s
+            end = len(result)
+            while end > len(result) - self.block_size and result[end - 1:end] == self.getPadding():
+                end -= 1
+            result = result[:end]
 
         # Return the full crypted string
-        return ''.join(result)
+        return result
 
     def encrypt(self, data, pad=''):
         """
@@ -513,8 +477,9 @@ class TripleDES(object):
     key  -> The encryption key string, must be either 16 or 24 bytes long
     mode -> Optional argument for encryption type, can be either pyDes.ECB
         (Electronic Code Book), pyDes.CBC (Cypher Block Chaining)
-    IV   -> Optional string argument, must be supplied if using CBC mode.
-        Must be 8 bytes in length.
+    IV   -> Optional string argument, used when crypting in CBC mode.
+        Must be 8 bytes in length. It can be left out here and passed to
+        decrypt() instead, so one object can be reused across many IVs.
     """
 
     def __init__(self, key, mode=ECB, IV=None):
@@ -536,8 +501,8 @@ class TripleDES(object):
                 self.key_size = 16
             else:
                 raise ValueError("Invalid triple DES key size. Key must be either 16 or 24 bytes long")
-        if self.getMode() == CBC and (not self.getIV() or len(self.getIV()) != self.block_size):
-            raise ValueError("Invalid IV, must be 8 bytes in length")  ## TODO: Check this
+        if self.getMode() == CBC and self.getIV() and len(self.getIV()) != self.block_size:
+            raise ValueError("Invalid IV, must be 8 bytes in length")
         # modes get handled later, since CBC goes on top of the triple-des
         self.__key1 = DES(key[:8])
         self.__key2 = DES(key[8:16])
@@ -613,12 +578,17 @@ class TripleDES(object):
 
         raise Exception("Not reached")
 
-    def decrypt(self, data, pad=''):
+    def decrypt(self, data, pad='', IV=None, out=None):
         """
-        decrypt(data, [pad]) -> string
+        decrypt(data, [pad], [IV], [out]) -> string
 
         data : String to be encrypted
         pad  : Optional argument for decryption padding. Must only be one byte
+        IV   : Optional Initial Value for CBC mode, overriding the one this
+               object was created with for this call only
+        out  : Optional bytearray for CBC mode to write the plaintext into,
+               at least len(data) bytes long. It is returned in place of a
+               new string, so one buffer can be reused across calls
 
         The data must be a multiple of 8 bytes and will be decrypted
         with the already specified key. If the optional padding character
@@ -636,21 +606,89 @@ class TripleDES(object):
             if len(data) % self.block_size != 0:
                 raise Exception("Can only decrypt multiples of blocksize")
 
-            lastblock = self.getIV()
-            retdata = ''
+            lastblock = IV or self.getIV()
+            if not lastblock or len(lastblock) != self.block_size:
+                raise ValueError("Invalid IV, must be 8 bytes in length")
+
+            if out is None:
+                retdata = bytearray(len(data))
+            elif len(out) < len(data):
+                raise ValueError("Output buffer too small, must be at least " + str(len(data)) + " bytes")
+            else:
+                retdata = out
+
+            # Blocks are read straight out of the ciphertext and written into
+            # retdata as 64-bit integers, the XOR for CBC is done on those too.
+            decrypt3 = self.__key3.crypt_block
+            encrypt2 = self.__key2.crypt_block
+            decrypt1 = self.__key1.crypt_block
+            unpack_from = _BLOCK.unpack_from
+            pack_into = _BLOCK.pack_into
+
+            ciphertext = memoryview(data)
+            lastblock = _BLOCK.unpack(lastblock)[0]
             for i in range(0, len(data), self.block_size):
-                # can I arrange this better? probably...
-                cipherchunk = data[i:i + self.block_size]
-                thisblock = self.__key3.decrypt(cipherchunk)
-                thisblock = self.__key2.encrypt(thisblock)
-                thisblock = self.__key1.decrypt(thisblock)
-                retdata += self.xorstr(lastblock, thisblock)
-                lastblock = cipherchunk
+                cipherblock = unpack_from(ciphertext, i)[0]
+                thisblock = decrypt1(encrypt2(decrypt3(cipherblock, DES.DECRYPT), DES.ENCRYPT), DES.DECRYPT)
+                pack_into(retdata, i, thisblock ^ lastblock)
+                lastblock = cipherblock
+
+            if out is None:
+                return bytes(retdata)
             return retdata
 
         raise Exception("Not reached")
 
 
+#############################################################################
+# 				Key schedule cache			    #
+#############################################################################
+class KeyScheduleCache(object):
+    """
+    Bounded LRU cache of CBC mode TripleDES objects, keyed by key bytes.
+
+    Expanding a triple DES key means building the subkeys for three DES
+    objects, which is wasted work when many messages are decrypted under
+    the same few keys. Objects handed out by get() hold no IV, so the IV
+    must be passed to each decrypt() call.
+
+    pyDes.KeyScheduleCache([maxsize])
+
+    maxsize -> Optional argument, number of key schedules to keep
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__schedules = OrderedDict()
+
+    def get(self, key):
+        """get(key) -> TripleDES object for key in CBC mode"""
+        key = bytes(key)
+        try:
+            # Re-inserted below, moving it to the most recently used end
+            cipher = self.__schedules.pop(key)
+            self.hits += 1
+        except KeyError:
+            cipher = TripleDES(key, CBC)
+            self.misses += 1
+            if len(self.__schedules) >= self.maxsize:
+                self.__schedules.popitem(last=False)
+
+        self.__schedules[key] = cipher
+        return cipher
+
+    def clear(self):
+        """Drop every cached key schedule and reset the counters"""
+        self.__schedules.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.__schedules)
+
+
 #############################################################################
 # 				Examples				    #
 #############################################################################
@@ -772,6 +810,44 @@ def __fulltest__():
             "000102030405060708FF8FDCB04080000102030405060708FF8FDCB04080000102030405060708FF8FDCB04080000102030405060708FF8FDCB04080000102030405060708FF8FDCB04080000102030405060708FF8FDCB04080000102030405060708FF8FDCB04080000102030405060708FF8FDCB04080"):
         print("Test 6 Error: Unencypted data block does not match start data")
 
+    # Known answer tests. The expected values were produced by the original
+    # bit-list implementation, so these also check that the table-driven
+    # engine crypts byte for byte the same.
+    k = DES(unhex("133457799BBCDFF1"))
+    if dohex(k.encrypt(unhex("0123456789ABCDEF"))) != "85e813540f0ab405":
+        print("Test 7 Error: DES ECB known answer does not match")
+
+    k = DES("DESCRYPT", CBC, "\0\0\0\0\0\0\0\0")
+    if dohex(k.encrypt("DES encryption algorithm")) != "e41911f42b63a182369ba17cb0490048aba8c52780f956c4":
+        print("Test 8 Error: DES CBC known answer does not match")
+
+    k = TripleDES(unhex("133457799BBCDFF1112233445566778877661100DD223311"))
+    d = k.encrypt("Triple DES test string, to be encrypted and decrypted...")
+    if dohex(d) != "39c58bea74feb11ab278020d56c310c8388452244f08ac207a21231b97ad88cb" \
+                   "4e30c5aff46ab8c4b1c00321008213cb030f4b47bcd102a7":
+        print("Test 9 Error: Triple DES ECB known answer does not match")
+
+    k = TripleDES(unhex("0123456789ABCDEF23456789ABCDEF01456789ABCDEF0123"), CBC, unhex("F69F2445DF4F9B17"))
+    d = k.decrypt(unhex("1234567890abcdef1234567890abcdef1234567890abcdef1234567890abcdef"))
+    if dohex(d) != "22f0a75b9480e560c65bd566db64b398c65bd566db64b398c65bd566db64b398":
+        print("Test 10 Error: Triple DES CBC known answer does not match")
+
+    cache = KeyScheduleCache(maxsize=1)
+    key = unhex("0123456789ABCDEF23456789ABCDEF01456789ABCDEF0123")
+    d = cache.get(key).decrypt(unhex("1234567890abcdef1234567890abcdef"), IV=unhex("F69F2445DF4F9B17"))
+    if dohex(d) != "22f0a75b9480e560c65bd566db64b398":
+        print("Test 11 Error: Cached key schedule does not decrypt with a per call IV")
+    cache.get(key)
+    cache.get(unhex("133457799BBCDFF1112233445566778877661100DD223311"))
+    if (cache.hits, cache.misses, len(cache)) != (1, 2, 1):
+        print("Test 12 Error: Key schedule cache counters or size are wrong")
+
+    k = TripleDES(unhex("0123456789ABCDEF23456789ABCDEF01456789ABCDEF0123"), CBC)
+    buf = bytearray(40)
+    d = k.decrypt(unhex("1234567890abcdef1234567890abcdef1234567890abcdef"), IV=unhex("F69F2445DF4F9B17"), out=buf)
+    if d is not buf or dohex(bytes(buf[:24])) != "22f0a75b9480e560c65bd566db64b398c65bd566db64b398":
+        print("Test 13 Error: Triple DES CBC decrypt into an output buffer does not match")
+
 
 def __filetest__():
     from time import time
@@ -804,7 +880,6 @@ def __profile__():
 # profile.run('__filetest__()')
 
 if __name__ == '__main__':
-    __test__()
-    # __fulltest__()
+    __fulltest__()
     # __filetest__()
     # __profile__()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+# Attribute filters for keychain records, e.g. "service~=vpn,account=admin".
+#
+# A filter is a comma separated list of terms that must all match. Each term
+# compares one attribute, named after its record class argument (service,
+# account, server, print_name, ...), with a value:
+#
+#   name=value    the attribute is exactly value
+#   name!=value   the attribute is not value
+#   name~=value   the attribute contains value, ignoring case
+#
+# Attributes are compared as they are stored in the keychain, as strings
+# (numbers in decimal, times as "YYYY-MM-DD hh:mm:ss").
+#
+# Filters are evaluated against the raw record before it is decoded: only the
+# header fields and attributes a filter names are read, so records that don't
+# match are skipped without building the record or decrypting its password.
+
+import re
+
+from schema import compile_raw_attribute_readers, _GENERIC_PW_ATTRIBUTES, _INTERNET_PW_ATTRIBUTES, \
+    _APPLE_SHARE_ATTRIBUTES, _X509_CERT_ATTRIBUTES, _SECKEY_ATTRIBUTES
+
+# Attribute names that can be filtered on
+ATTRIBUTES = sorted(set(name for layout in (_GENERIC_PW_ATTRIBUTES, _INTERNET_PW_ATTRIBUTES, _APPLE_SHARE_ATTRIBUTES,
+                                            _X509_CERT_ATTRIBUTES, _SECKEY_ATTRIBUTES)
+                        for name, field, attr_type in layout))
+
+_TERM = re.compile(r'^\s*(\w+)\s*(~=|!=|=)(.*)$')
+
+_OPERATORS = {
+    '=': lambda value, expected: value == expected,
+    '!=': lambda value, expected: value != expected,
+    '~=': lambda value, expected: expected.lower() in value.lower(),
+}
+
+
+class RecordFilter(object):
+    # Parses a filter expression. Raises ValueError if it is malformed or names an unknown attribute.
+    def __init__(self, expression):
+        self.expression = expression
+        self.terms = []
+
+        for term in expression.split(','):
+            if not term.strip():
+                continue
+
+            match = _TERM.match(term)
+            if match is None:
+                raise ValueError("Invalid filter term %r, expected name=value, name!=value or name~=value" % term)
+
+            name, operator, value = match.groups()
+            if name not in ATTRIBUTES:
+                raise ValueError("Unknown filter attribute %r, expected one of: %s" % (name, ', '.join(ATTRIBUTES)))
+
+            self.terms.append((name, _OPERATORS[operator], value))
+
+        if not self.terms:
+            raise ValueError("Empty filter")
+
+        # (header class, layout) -> predicate
+        self._predicates = {}
+
+    def __str__(self):
+        return self.expression
+
+    # Returns a function taking the keychain buffer and the address of a record of the given header class and
+    # attribute layout, which returns True if the record matches. Returns None if the layout lacks an attribute
+    # the filter names, as then no record of that type can match.
+    def compile(self, header_class, layout):
+        key = (header_class, id(layout))
+        if key not in self._predicates:
+            self._predicates[key] = self._compile(header_class, layout)
+        return self._predicates[key]
+
+    def _compile(self, header_class, layout):
+        readers = compile_raw_attribute_readers(header_class, layout)
+
+        checks = []
+        for name, operator, expected in self.terms:
+            if name not in readers:
+                return None
+            checks.append((readers[name], operator, expected))
+
+        def predicate(buffer, base_addr):
+            for read, operator, expected in checks:
+                if not operator(str(read(buffer, base_addr)), expected):
+                    return False
+            return True
+
+        return predicate
@@ -1,5 +1,7 @@
 from struct import Struct
 from datetime import datetime
+from operator import attrgetter
+import logging
 
 # http://web.mit.edu/darwin/src/modules/Security/cdsa/cdsa/cssmtype.h
 KEY_TYPE = {
@@ -319,33 +321,73 @@ CARBON_DEFINES = {
 class _APPL_DB_HEADER(object):
     STRUCT = Struct('> 4s i i i i')
 
-    def __init__(self, buffer):
+    __slots__ = ('Signature', 'Version', 'HeaderSize', 'SchemaOffset', 'AuthOffset')
+
+    def __init__(self, buffer, offset=0):
         (self.Signature, self.Version, self.HeaderSize, self.SchemaOffset,
-         self.AuthOffset) = _APPL_DB_HEADER.STRUCT.unpack(
-            buffer)
+         self.AuthOffset) = _APPL_DB_HEADER.STRUCT.unpack_from(buffer, offset)
 
 
 class _APPL_DB_SCHEMA(object):
     STRUCT = Struct('> i i')
 
-    def __init__(self, buffer):
-        (self.SchemaSize, self.TableCount) = _APPL_DB_SCHEMA.STRUCT.unpack(buffer)
+    __slots__ = ('SchemaSize', 'TableCount')
+
+    def __init__(self, buffer, offset=0):
+        (self.SchemaSize, self.TableCount) = _APPL_DB_SCHEMA.STRUCT.unpack_from(buffer, offset)
 
 
 class _TABLE_HEADER(object):
     STRUCT = Struct('> I I I I I I I')
 
-    def __init__(self, buffer):
+    __slots__ = (
+        'TableSize', 'TableId', 'RecordCount', 'Records', 'IndexesOffset', 'FreeListHead', 'RecordNumbersCount')
+
+    def __init__(self, buffer, offset=0):
         (self.TableSize, self.TableId, self.RecordCount, self.Records, self.IndexesOffset, self.FreeListHead,
-         self.RecordNumbersCount) = _TABLE_HEADER.STRUCT.unpack(buffer)
+         self.RecordNumbersCount) = _TABLE_HEADER.STRUCT.unpack_from(buffer, offset)
+
+
+# Index of a table, found through the table's IndexesOffset. IndexType is CSSM_DB_INDEX_UNIQUE (0) or
+# CSSM_DB_INDEX_NONUNIQUE (1). The header is followed by the ids of the attributes the index is keyed on, the
+# key count, the offsets of the keys (from the start of the index), sorted by key, and the number of the record
+# each key is for. Raises ValueError if the arrays don't fit in IndexSize.
+class _TABLE_INDEX(object):
+    STRUCT = Struct('> I I I I')
+
+    __slots__ = ('IndexSize', 'IndexId', 'IndexType', 'AttributeCount', 'AttributeIds', 'KeyOffsets',
+                 'RecordNumbers')
+
+    def __init__(self, buffer, offset=0):
+        (self.IndexSize, self.IndexId, self.IndexType,
+         self.AttributeCount) = _TABLE_INDEX.STRUCT.unpack_from(buffer, offset)
+
+        end = offset + self.IndexSize
+        offset += _TABLE_INDEX.STRUCT.size
+        if offset + 4 * (self.AttributeCount + 1) > end:
+            raise ValueError("index %d attributes run past the end of the index" % self.IndexId)
+        self.AttributeIds = Struct('>%dI' % self.AttributeCount).unpack_from(buffer, offset)
+        offset += 4 * self.AttributeCount
+
+        key_count = _INT.STRUCT.unpack_from(buffer, offset)[0]
+        offset += 4
+        if offset + 8 * key_count > end:
+            raise ValueError("index %d keys run past the end of the index" % self.IndexId)
+        keys = Struct('>%dI' % key_count)
+        self.KeyOffsets = keys.unpack_from(buffer, offset)
+        self.RecordNumbers = keys.unpack_from(buffer, offset + 4 * key_count)
 
 
 class _DB_BLOB(object):
     STRUCT = Struct('> 8s I I 16s I 8s 20s 8s 20s')
 
-    def __init__(self, buffer):
+    __slots__ = (
+        'CommonBlobBuffer', 'StartCryptoBlob', 'TotalLength', 'RandomSignature', 'Sequence', 'ParamsBuffer', 'Salt',
+        'IV', 'BlobSignature', 'CommonBlob', 'Params')
+
+    def __init__(self, buffer, offset=0):
         (self.CommonBlobBuffer, self.StartCryptoBlob, self.TotalLength, self.RandomSignature, self.Sequence,
-         self.ParamsBuffer, self.Salt, self.IV, self.BlobSignature) = _DB_BLOB.STRUCT.unpack(buffer)
+         self.ParamsBuffer, self.Salt, self.IV, self.BlobSignature) = _DB_BLOB.STRUCT.unpack_from(buffer, offset)
 
         self.CommonBlob = _COMMON_BLOB(self.CommonBlobBuffer)
         self.Params = _DB_PARAMETERS(self.ParamsBuffer)
@@ -354,39 +396,53 @@ class _DB_BLOB(object):
 class _COMMON_BLOB(object):
     STRUCT = Struct('> L l')
 
-    def __init__(self, buffer):
-        (self.Magic, self.BlobVersion) = _COMMON_BLOB.STRUCT.unpack(buffer)
+    __slots__ = ('Magic', 'BlobVersion')
+
+    def __init__(self, buffer, offset=0):
+        (self.Magic, self.BlobVersion) = _COMMON_BLOB.STRUCT.unpack_from(buffer, offset)
 
 
 class _DB_PARAMETERS(object):
     STRUCT = Struct('> I I')
-    def __init__(self, buffer):
-        (self.IdleTimeout, self.LockOnSleep) = _DB_PARAMETERS.STRUCT.unpack(buffer)
+    __slots__ = ('IdleTimeout', 'LockOnSleep')
+
+    def __init__(self, buffer, offset=0):
+        (self.IdleTimeout, self.LockOnSleep) = _DB_PARAMETERS.STRUCT.unpack_from(buffer, offset)
 
 
 class _GENERIC_PW_HEADER(object):
     STRUCT = Struct('> I I I I I I I I I I I I I I I I I I I I I I')
 
-    def __init__(self, buffer):
+    __slots__ = (
+        'RecordSize', 'RecordNumber', 'Unknown2', 'Unknown3', 'SSGPArea', 'Unknown5', 'CreationDate', 'ModDate',
+        'Description', 'Comment', 'Creator', 'Type', 'ScriptCode', 'PrintName', 'Alias', 'Invisible', 'Negative',
+        'CustomIcon', 'Protected', 'Account', 'Service', 'Generic')
+
+    def __init__(self, buffer, offset=0):
         (self.RecordSize, self.RecordNumber, self.Unknown2, self.Unknown3, self.SSGPArea, self.Unknown5,
          self.CreationDate, self.ModDate, self.Description, self.Comment, self.Creator, self.Type, self.ScriptCode,
          self.PrintName, self.Alias, self.Invisible, self.Negative, self.CustomIcon, self.Protected, self.Account,
-         self.Service, self.Generic,) = _GENERIC_PW_HEADER.STRUCT.unpack(buffer)
+         self.Service, self.Generic,) = _GENERIC_PW_HEADER.STRUCT.unpack_from(buffer, offset)
 
 
 class _KEY_BLOB_REC_HEADER(object):
     STRUCT = Struct('> I I 124s ')
 
-    def __init__(self, buffer):
-        (self.RecordSize, self.RecordCount, self.Dummy) = _KEY_BLOB_REC_HEADER.STRUCT.unpack(buffer)
+    __slots__ = ('RecordSize', 'RecordCount', 'Dummy')
+
+    def __init__(self, buffer, offset=0):
+        (self.RecordSize, self.RecordCount, self.Dummy) = _KEY_BLOB_REC_HEADER.STRUCT.unpack_from(buffer, offset)
 
 
 class _KEY_BLOB(object):
     STRUCT = Struct('> 8s I I 8s')
     COMMON_BLOB_MAGIC = 0xFADE0711
 
-    def __init__(self, buffer):
-        (self.CommonBlobBuffer, self.StartCryptoBlob, self.TotalLength, self.IV,) = _KEY_BLOB.STRUCT.unpack(buffer)
+    __slots__ = ('CommonBlobBuffer', 'StartCryptoBlob', 'TotalLength', 'IV', 'CommonBlob')
+
+    def __init__(self, buffer, offset=0):
+        (self.CommonBlobBuffer, self.StartCryptoBlob, self.TotalLength,
+         self.IV,) = _KEY_BLOB.STRUCT.unpack_from(buffer, offset)
 
         self.CommonBlob = _COMMON_BLOB(self.CommonBlobBuffer)
 
@@ -395,40 +451,56 @@ class _KEY_BLOB(object):
 class _SSGP(object):
     STRUCT = Struct('> 4s 16s 8s')
 
+    __slots__ = ('Magic', 'Label', 'IV', 'EncryptedPassword')
+
     def __init__(self, buffer):
-        (self.Magic, self.Label, self.IV,) = _SSGP.STRUCT.unpack(buffer[:28])
-        self.EncryptedPassword = buffer[28:]
+        (self.Magic, self.Label, self.IV,) = _SSGP.STRUCT.unpack_from(buffer)
+        self.EncryptedPassword = buffer[_SSGP.STRUCT.size:]
 
 
 class _INTERNET_PW_HEADER(object):
     STRUCT = Struct('> I I I I I I I I I I I I I I I I I I I I I I I I I I')
 
-    def __init__(self, buffer):
+    __slots__ = (
+        'RecordSize', 'RecordNumber', 'Unknown2', 'Unknown3', 'SSGPArea', 'Unknown5', 'CreationDate', 'ModDate',
+        'Description', 'Comment', 'Creator', 'Type', 'ScriptCode', 'PrintName', 'Alias', 'Invisible', 'Negative',
+        'CustomIcon', 'Protected', 'Account', 'SecurityDomain', 'Server', 'Protocol', 'AuthType', 'Port', 'Path')
+
+    def __init__(self, buffer, offset=0):
         (self.RecordSize, self.RecordNumber, self.Unknown2, self.Unknown3, self.SSGPArea, self.Unknown5,
          self.CreationDate, self.ModDate, self.Description, self.Comment, self.Creator, self.Type, self.ScriptCode,
          self.PrintName, self.Alias, self.Invisible, self.Negative, self.CustomIcon, self.Protected, self.Account,
          self.SecurityDomain, self.Server, self.Protocol, self.AuthType, self.Port,
-         self.Path,) = _INTERNET_PW_HEADER.STRUCT.unpack(buffer)
+         self.Path,) = _INTERNET_PW_HEADER.STRUCT.unpack_from(buffer, offset)
 
 
 class _APPLE_SHARE_HEADER(object):
     STRUCT = Struct('> I I I I I I I I I I I I I I I I I I I I I I I I I I')
 
-    def __init__(self, buffer):
+    __slots__ = (
+        'RecordSize', 'RecordNumber', 'Unknown2', 'Unknown3', 'SSGPArea', 'Unknown5', 'CreationDate', 'ModDate',
+        'Description', 'Comment', 'Creator', 'Type', 'ScriptCode', 'PrintName', 'Alias', 'Invisible', 'Negative',
+        'CustomIcon', 'Protected', 'Account', 'Volume', 'Server', 'Protocol', 'AuthType', 'Address', 'Signature')
+
+    def __init__(self, buffer, offset=0):
         (self.RecordSize, self.RecordNumber, self.Unknown2, self.Unknown3, self.SSGPArea, self.Unknown5,
          self.CreationDate, self.ModDate, self.Description, self.Comment, self.Creator, self.Type, self.ScriptCode,
          self.PrintName, self.Alias, self.Invisible, self.Negative, self.CustomIcon, self.Protected, self.Account,
          self.Volume, self.Server, self.Protocol, self.AuthType, self.Address,
-         self.Signature,) = _APPLE_SHARE_HEADER.STRUCT.unpack(buffer)
+         self.Signature,) = _APPLE_SHARE_HEADER.STRUCT.unpack_from(buffer, offset)
 
 
 class _X509_CERT_HEADER(object):
     STRUCT = Struct('> I I I I I I I I I I I I I I I')
 
-    def __init__(self, buffer):
+    __slots__ = (
+        'RecordSize', 'RecordNumber', 'Unknown1', 'Unknown2', 'CertSize', 'Unknown3', 'CertType', 'CertEncoding',
+        'PrintName', 'Alias', 'Subject', 'Issuer', 'SerialNumber', 'SubjectKeyIdentifier', 'PublicKeyHash')
+
+    def __init__(self, buffer, offset=0):
         (self.RecordSize, self.RecordNumber, self.Unknown1, self.Unknown2, self.CertSize, self.Unknown3, self.CertType,
          self.CertEncoding, self.PrintName, self.Alias, self.Subject, self.Issuer, self.SerialNumber,
-         self.SubjectKeyIdentifier, self.PublicKeyHash,) = _X509_CERT_HEADER.STRUCT.unpack(buffer)
+         self.SubjectKeyIdentifier, self.PublicKeyHash,) = _X509_CERT_HEADER.STRUCT.unpack_from(buffer, offset)
 
 
 # # http://www.opensource.apple.com/source/Security/Security-55179.1/include/security_cdsa_utilities/KeySchema.h
@@ -437,20 +509,28 @@ class _X509_CERT_HEADER(object):
 class _SECKEY_HEADER(object):
     STRUCT = Struct('> I I I I I I I I I I I I I I I I I I I I I I I I I I I I I I I I I')
 
-    def __init__(self, buffer):
+    __slots__ = (
+        'RecordSize', 'RecordNumber', 'Unknown1', 'Unknown2', 'BlobSize', 'Unknown3', 'KeyClass', 'PrintName', 'Alias',
+        'Permanent', 'Private', 'Modifiable', 'Label', 'ApplicationTag', 'KeyCreator', 'KeyType', 'KeySizeInBits',
+        'EffectiveKeySize', 'StartDate', 'EndDate', 'Sensitive', 'AlwaysSensitive', 'Extractable', 'NeverExtractable',
+        'Encrypt', 'Decrypt', 'Derive', 'Sign', 'Verify', 'SignRecover', 'VerifyRecover', 'Wrap', 'UnWrap')
+
+    def __init__(self, buffer, offset=0):
         (self.RecordSize, self.RecordNumber, self.Unknown1, self.Unknown2, self.BlobSize, self.Unknown3, self.KeyClass,
          self.PrintName, self.Alias, self.Permanent, self.Private, self.Modifiable, self.Label, self.ApplicationTag,
          self.KeyCreator, self.KeyType, self.KeySizeInBits, self.EffectiveKeySize, self.StartDate, self.EndDate,
          self.Sensitive, self.AlwaysSensitive, self.Extractable, self.NeverExtractable, self.Encrypt, self.Decrypt,
          self.Derive, self.Sign, self.Verify, self.SignRecover, self.VerifyRecover, self.Wrap,
-         self.UnWrap,) = _SECKEY_HEADER.STRUCT.unpack(buffer)
+         self.UnWrap,) = _SECKEY_HEADER.STRUCT.unpack_from(buffer, offset)
 
 
 class _UNLOCK_BLOB(object):
     STRUCT = Struct('> 8s 24s 16s')
 
-    def __init__(self, buffer):
-        (self.CommonBlobBuffer, self.MasterKey, self.BlobSignature) = _UNLOCK_BLOB.STRUCT.unpack(buffer)
+    __slots__ = ('CommonBlobBuffer', 'MasterKey', 'BlobSignature', 'CommonBlob')
+
+    def __init__(self, buffer, offset=0):
+        (self.CommonBlobBuffer, self.MasterKey, self.BlobSignature) = _UNLOCK_BLOB.STRUCT.unpack_from(buffer, offset)
 
         self.CommonBlob = _COMMON_BLOB(self.CommonBlobBuffer)
 
@@ -459,9 +539,43 @@ class _KEYCHAIN_TIME(object):
     STRUCT = Struct('>16s')
     STRPTIME_FORMAT = "%Y%m%d%H%M%SZ"
 
-    def __init__(self, buffer):
-        self.Value = _KEYCHAIN_TIME.STRUCT.unpack(buffer)[0].strip('\x00')
-        self.Time = datetime.strptime(self.Value, _KEYCHAIN_TIME.STRPTIME_FORMAT)
+    # Parsed times by raw value. Records created or synced together share timestamps, so a dump sees the
+    # same values again and again. Cleared when it reaches CACHE_SIZE entries.
+    CACHE = {}
+    CACHE_SIZE = 4096
+
+    __slots__ = ('Value', 'Time')
+
+    def __init__(self, buffer, offset=0):
+        raw = _KEYCHAIN_TIME.STRUCT.unpack_from(buffer, offset)[0]
+        self.Value = raw.strip('\x00')
+        self.Time = _KEYCHAIN_TIME.parse(raw)
+
+    # Parses a raw YYYYMMDDhhmmssZ value, NUL padded to 16 bytes, into a datetime. Returns the value with
+    # the padding stripped if it is not a valid time, e.g. '' for a zero filled one.
+    @staticmethod
+    def parse(raw):
+        try:
+            return _KEYCHAIN_TIME.CACHE[raw]
+        except KeyError:
+            pass
+
+        value = raw.strip('\x00')
+        time = value
+        if len(value) == 15 and value[14] == 'Z' and value[:14].isdigit():
+            try:
+                time = datetime(int(value[0:4]), int(value[4:6]), int(value[6:8]), int(value[8:10]),
+                                int(value[10:12]), int(value[12:14]))
+            except ValueError:
+                pass
+
+        if time is value and value:
+            logging.getLogger('Chainbreaker').debug('Invalid keychain time: %r' % value)
+
+        if len(_KEYCHAIN_TIME.CACHE) >= _KEYCHAIN_TIME.CACHE_SIZE:
+            _KEYCHAIN_TIME.CACHE.clear()
+        _KEYCHAIN_TIME.CACHE[raw] = time
+        return time
 
     def __repr__(self):
         return
@@ -470,26 +584,233 @@ class _KEYCHAIN_TIME(object):
 class _INT(object):
     STRUCT = Struct('>I')
 
-    def __init__(self, buffer):
-        self.Value = _INT.STRUCT.unpack(buffer)[0]
+    __slots__ = ('Value',)
+
+    def __init__(self, buffer, offset=0):
+        self.Value = _INT.STRUCT.unpack_from(buffer, offset)[0]
 
 
 class _FOUR_CHAR_CODE(object):
     STRUCT = Struct('>4s')
 
-    def __init__(self, buffer):
-        self.Value = _FOUR_CHAR_CODE.STRUCT.unpack(buffer)[0]
+    __slots__ = ('Value',)
 
+    def __init__(self, buffer, offset=0):
+        self.Value = _FOUR_CHAR_CODE.STRUCT.unpack_from(buffer, offset)[0]
 
-class _LV(object):
-    def __init__(self, buffer, length):
-        self.STRUCT = Struct(">" + str(length) + "s")
-        self.Value = self.STRUCT.unpack(buffer)[0].strip('\x00')
 
+class _TABLE_ID(_INT):
+    __slots__ = ()
 
-class _RECORD_OFFSET(_INT):
-    pass
 
+########## RECORD ATTRIBUTES ##########
+# Record headers hold, for each attribute, its offset from the start of the record (the low bit is a flag).
+# An offset of 0 means the attribute is not set.
 
-class _TABLE_ID(_INT):
-    pass
+ATTR_INT = 'int'
+ATTR_FOUR_CHAR_CODE = 'four_char_code'
+ATTR_TIME = 'time'
+ATTR_LV = 'lv'
+
+
+def _read_int(buffer, base_addr, pcol):
+    if pcol <= 0:
+        return 0
+    return _INT.STRUCT.unpack_from(buffer, base_addr + pcol)[0]
+
+
+def _read_four_char_code(buffer, base_addr, pcol):
+    if pcol <= 0:
+        return ''
+    return _FOUR_CHAR_CODE.STRUCT.unpack_from(buffer, base_addr + pcol)[0]
+
+
+def _read_time(buffer, base_addr, pcol):
+    if pcol <= 0:
+        return ''
+    return _KEYCHAIN_TIME.parse(_KEYCHAIN_TIME.STRUCT.unpack_from(buffer, base_addr + pcol)[0])
+
+
+# Length prefixed value, padded to a multiple of 4 bytes. NUL bytes around the value are stripped.
+def _read_lv(buffer, base_addr, pcol):
+    if pcol <= 0:
+        return ''
+
+    start = base_addr + pcol + 4
+    # 4byte arrangement
+    end = start + ((_INT.STRUCT.unpack_from(buffer, base_addr + pcol)[0] + 3) & ~3)
+
+    if end > len(buffer):
+        logging.getLogger('Chainbreaker').debug('LV string length is too long.')
+        return ''
+
+    return buffer[start:end].strip('\x00')
+
+
+_ATTRIBUTE_READERS = {
+    ATTR_INT: _read_int,
+    ATTR_FOUR_CHAR_CODE: _read_four_char_code,
+    ATTR_TIME: _read_time,
+    ATTR_LV: _read_lv,
+}
+
+# Attribute layouts: (record class argument, record header field, attribute type)
+_GENERIC_PW_ATTRIBUTES = [
+    ('created', 'CreationDate', ATTR_TIME),
+    ('last_modified', 'ModDate', ATTR_TIME),
+    ('description', 'Description', ATTR_LV),
+    ('creator', 'Creator', ATTR_FOUR_CHAR_CODE),
+    ('type', 'Type', ATTR_FOUR_CHAR_CODE),
+    ('print_name', 'PrintName', ATTR_LV),
+    ('alias', 'Alias', ATTR_LV),
+    ('account', 'Account', ATTR_LV),
+    ('service', 'Service', ATTR_LV),
+]
+
+_INTERNET_PW_ATTRIBUTES = [
+    ('created', 'CreationDate', ATTR_TIME),
+    ('last_modified', 'ModDate', ATTR_TIME),
+    ('description', 'Description', ATTR_LV),
+    ('comment', 'Comment', ATTR_LV),
+    ('creator', 'Creator', ATTR_FOUR_CHAR_CODE),
+    ('type', 'Type', ATTR_FOUR_CHAR_CODE),
+    ('print_name', 'PrintName', ATTR_LV),
+    ('alias', 'Alias', ATTR_LV),
+    ('protected', 'Protected', ATTR_LV),
+    ('account', 'Account', ATTR_LV),
+    ('security_domain', 'SecurityDomain', ATTR_LV),
+    ('server', 'Server', ATTR_LV),
+    ('protocol_type', 'Protocol', ATTR_FOUR_CHAR_CODE),
+    ('auth_type', 'AuthType', ATTR_LV),
+    ('port', 'Port', ATTR_INT),
+    ('path', 'Path', ATTR_LV),
+]
+
+_APPLE_SHARE_ATTRIBUTES = [
+    ('created', 'CreationDate', ATTR_TIME),
+    ('last_modified', 'ModDate', ATTR_TIME),
+    ('description', 'Description', ATTR_LV),
+    ('comment', 'Comment', ATTR_LV),
+    ('creator', 'Creator', ATTR_FOUR_CHAR_CODE),
+    ('type', 'Type', ATTR_FOUR_CHAR_CODE),
+    ('print_name', 'PrintName', ATTR_LV),
+    ('alias', 'Alias', ATTR_LV),
+    ('protected', 'Protected', ATTR_LV),
+    ('account', 'Account', ATTR_LV),
+    ('volume', 'Volume', ATTR_LV),
+    ('server', 'Server', ATTR_LV),
+    ('protocol_type', 'Protocol', ATTR_FOUR_CHAR_CODE),
+    ('address', 'Address', ATTR_LV),
+    ('signature', 'Signature', ATTR_LV),
+]
+
+_X509_CERT_ATTRIBUTES = [
+    ('type', 'CertType', ATTR_INT),
+    ('encoding', 'CertEncoding', ATTR_INT),
+    ('print_name', 'PrintName', ATTR_LV),
+    ('alias', 'Alias', ATTR_LV),
+    ('subject', 'Subject', ATTR_LV),
+    ('issuer', 'Issuer', ATTR_LV),
+    ('serial_number', 'SerialNumber', ATTR_LV),
+    ('subject_key_identifier', 'SubjectKeyIdentifier', ATTR_LV),
+    ('public_key_hash', 'PublicKeyHash', ATTR_LV),
+]
+
+# Public and private keys. key_type and key_creator are looked up in CSSM_ALGORITHMS and
+# STD_APPLE_ADDIN_MODULE once decoded.
+_SECKEY_ATTRIBUTES = [
+    ('print_name', 'PrintName', ATTR_LV),
+    ('label', 'Label', ATTR_LV),
+    ('key_class', 'KeyClass', ATTR_INT),
+    ('private', 'Private', ATTR_INT),
+    ('key_type', 'KeyType', ATTR_INT),
+    ('key_size', 'KeySizeInBits', ATTR_INT),
+    ('effective_key_size', 'EffectiveKeySize', ATTR_INT),
+    ('extracted', 'Extractable', ATTR_INT),
+    ('key_creator', 'KeyCreator', ATTR_LV),
+]
+
+
+# Builds the decoder for one record type from its header class and attribute layout. The decoder takes the
+# keychain buffer and the address of a record, and returns the record header and a dict of the decoded
+# attributes keyed by their record class argument.
+def compile_record_decoder(header_class, layout):
+    get_offsets = attrgetter(*[field for name, field, attr_type in layout])
+    readers = [(name, _ATTRIBUTE_READERS[attr_type]) for name, field, attr_type in layout]
+
+    def decode(buffer, base_addr):
+        header = header_class(buffer, base_addr)
+        return header, dict((name, read(buffer, base_addr, pcol & 0xFFFFFFFE))
+                            for (name, read), pcol in zip(readers, get_offsets(header)))
+
+    return decode
+
+
+def _attribute_reader(field, read):
+    get_offset = attrgetter(field)
+
+    def read_attribute(buffer, base_addr, header):
+        return read(buffer, base_addr, get_offset(header) & 0xFFFFFFFE)
+
+    return read_attribute
+
+
+# Builds readers that decode the attributes of a layout one at a time, for records decoded lazily. Returns a
+# dict mapping the record attribute each one is stored in to a function taking the keychain buffer, the
+# address of a record and its header. Attributes are named after their record class argument in CamelCase
+# (print_name -> PrintName) unless attribute_names says otherwise.
+def compile_attribute_readers(layout, attribute_names=None):
+    attribute_names = attribute_names or {}
+    readers = {}
+    for name, field, attr_type in layout:
+        attribute = attribute_names.get(name) or ''.join(part.capitalize() for part in name.split('_'))
+        readers[attribute] = _attribute_reader(field, _ATTRIBUTE_READERS[attr_type])
+
+    return readers
+
+
+def _raw_attribute_reader(field_offset, read):
+    unpack_from = _INT.STRUCT.unpack_from
+
+    def read_attribute(buffer, base_addr):
+        return read(buffer, base_addr, unpack_from(buffer, base_addr + field_offset)[0] & 0xFFFFFFFE)
+
+    return read_attribute
+
+
+# Builds readers that decode single attributes straight from a record in the keychain buffer, without parsing
+# its header. Returns a dict mapping the record class argument of each attribute in the layout to a function
+# taking the keychain buffer and the address of a record. Record headers are runs of 4 byte offsets, so a
+# field is found from its position alone.
+def compile_raw_attribute_readers(header_class, layout):
+    field_offsets = dict((field, 4 * index) for index, field in enumerate(header_class.__slots__))
+    return dict((name, _raw_attribute_reader(field_offsets[field], _ATTRIBUTE_READERS[attr_type]))
+                for name, field, attr_type in layout)
+
+
+# Attribute ids of the record header fields, as used by the table indexes. Password and certificate attributes
+# are identified by four character codes (SecKeychainItem.h), key attributes by their position in the key
+# schema, which starts at KeyClass (KeySchema.h).
+_ITEM_ATTRIBUTE_CODES = {
+    'CreationDate': 'cdat', 'ModDate': 'mdat', 'Description': 'desc', 'Comment': 'icmt', 'Creator': 'crtr',
+    'Type': 'type', 'ScriptCode': 'scrp', 'PrintName': 'labl', 'Alias': 'alis', 'Invisible': 'invi',
+    'Negative': 'nega', 'CustomIcon': 'cusi', 'Protected': 'prot', 'Account': 'acct', 'Service': 'svce',
+    'Generic': 'gena', 'SecurityDomain': 'sdmn', 'Server': 'srvr', 'Protocol': 'ptcl', 'AuthType': 'atyp',
+    'Port': 'port', 'Path': 'path', 'Volume': 'vlme', 'Address': 'addr', 'Signature': 'ssig', 'CertType': 'ctyp',
+    'CertEncoding': 'cenc', 'Subject': 'subj', 'Issuer': 'issu', 'SerialNumber': 'snbr',
+    'SubjectKeyIdentifier': 'skid', 'PublicKeyHash': 'hpky',
+}
+
+
+def _attribute_id(header_class, field):
+    if header_class is _SECKEY_HEADER:
+        return header_class.__slots__.index(field) - header_class.__slots__.index('KeyClass')
+    return _INT.STRUCT.unpack(_ITEM_ATTRIBUTE_CODES[field])[0]
+
+
+# Builds readers for the keys of a table index. Returns a dict mapping the attribute id of each attribute in
+# the layout to its record class argument and a function taking the keychain buffer, the address of an index
+# and the offset of a key, which decodes the attribute value the key starts with.
+def compile_index_key_readers(header_class, layout):
+    return dict((_attribute_id(header_class, field), (name, _ATTRIBUTE_READERS[attr_type]))
+                for name, field, attr_type in layout)
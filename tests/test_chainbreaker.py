@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+# Tests of the keychain parser, against tests/data/test.keychain. The keychain's password is password123, and its
+# generic password table has indexes on the service and account of its records.
+#
+# Run with: python -m unittest discover tests
+
+import os
+import struct
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from chainbreaker import Chainbreaker, CSSM_DL_DB_RECORD_GENERIC_PASSWORD
+from schema import _APPL_DB_HEADER
+
+KEYCHAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'test.keychain')
+PASSWORD = 'password123'
+
+
+class ReadKeychainTest(unittest.TestCase):
+    @staticmethod
+    def _passwords(keychain):
+        return [(record.Service, record.Account, record.Password) for record in keychain.iter_generic_passwords()]
+
+    # A pipe can't be mapped, so it is read into memory, and parses the same as the mapped file
+    def test_read_from_pipe(self):
+        with open(KEYCHAIN, 'rb') as f:
+            content = f.read()
+
+        read_fd, write_fd = os.pipe()
+
+        def write():
+            try:
+                os.write(write_fd, content)
+            finally:
+                os.close(write_fd)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            piped = Chainbreaker('/dev/fd/%d' % read_fd, unlock_password=PASSWORD)
+        finally:
+            writer.join()
+            os.close(read_fd)
+
+        with Chainbreaker(KEYCHAIN, unlock_password=PASSWORD) as mapped:
+            self.assertEqual(piped.kc_buffer, content)
+            self.assertFalse(piped.locked)
+            self.assertEqual(self._passwords(piped), self._passwords(mapped))
+
+
+class DiskIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.keychain = Chainbreaker(KEYCHAIN, unlock_password=PASSWORD)
+
+    def tearDown(self):
+        self.keychain.close()
+
+    # The index section is laid out as AppleDatabase's writeIndexSection writes it: the section size, the index
+    # count, then the offset of each index from the start of the section.
+    def test_index_section_header(self):
+        table_offset = self.keychain._get_table_offset(CSSM_DL_DB_RECORD_GENERIC_PASSWORD)
+        table_metadata = self.keychain._get_table(table_offset)[0]
+        section_addr = _APPL_DB_HEADER.STRUCT.size + table_offset + table_metadata.IndexesOffset
+
+        section_size, index_count, first_index = struct.unpack_from('>III', self.keychain.kc_buffer, section_addr)
+        self.assertEqual(index_count, 2)
+        self.assertEqual(first_index, 4 * (2 + index_count))
+        self.assertEqual(section_addr + section_size,
+                         _APPL_DB_HEADER.STRUCT.size + table_offset + table_metadata.TableSize)
+
+    def test_lookups_use_the_disk_index(self):
+        disk_index_lookups, scan_lookups = Chainbreaker.disk_index_lookups, Chainbreaker.scan_lookups
+
+        records = self.keychain.find_generic_passwords(service='mail')
+        self.assertEqual(sorted(record.Account for record in records), ['user1@example.com', 'user2@example.com'])
+        self.assertEqual(self.keychain.find_generic_passwords(service='none'), [])
+
+        self.assertEqual(Chainbreaker.disk_index_lookups - disk_index_lookups, 2)
+        self.assertEqual(Chainbreaker.scan_lookups, scan_lookups)
+
+    # Every lookup through the disk index finds the same records as reading the attribute from every record
+    def test_disk_index_matches_scan(self):
+        services = set(record.Service for record in self.keychain.iter_generic_passwords())
+        self.assertTrue(services)
+        for service in services:
+            scanned = [record.Account for record in self.keychain.iter_generic_passwords()
+                       if record.Service == service]
+            self.assertEqual(sorted(record.Account for record in self.keychain.find_generic_passwords(service=service)),
+                             sorted(scanned))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+# Tests of the wordlist search, against tests/data/test.keychain, whose password is password123.
+#
+# Run with: python -m unittest discover tests
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from chainbreaker import Chainbreaker
+from wordlist import WordlistSearch
+
+KEYCHAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'test.keychain')
+PASSWORD = 'password123'
+
+
+class WordlistSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wordlist = os.path.join(self.directory, 'wordlist.txt')
+        self.state_file = os.path.join(self.directory, 'state.json')
+
+        # The password is in the middle of the third chunk, with wrong candidates after it in the same chunk
+        candidates = ['wrong%d' % i for i in range(3 * WordlistSearch.CHUNK_SIZE)]
+        candidates.insert(2 * WordlistSearch.CHUNK_SIZE + 10, PASSWORD)
+        with open(self.wordlist, 'w') as f:
+            f.write('\n'.join(candidates) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _search(self, resume=False):
+        with Chainbreaker(KEYCHAIN) as keychain:
+            search = WordlistSearch(keychain, self.wordlist, processes=2, state_file=self.state_file)
+            if resume:
+                search.resume()
+            password = search.run()
+            return password, search.index, keychain.locked
+
+    # The checkpoint written after a hit stops before the chunk the password is in, so resuming finds it again
+    def test_resume_after_hit(self):
+        password, index, locked = self._search()
+        self.assertEqual(password, PASSWORD)
+        self.assertFalse(locked)
+        self.assertEqual(index, 2 * WordlistSearch.CHUNK_SIZE)
+
+        password, index, locked = self._search(resume=True)
+        self.assertEqual(password, PASSWORD)
+        self.assertFalse(locked)
+
+
+if __name__ == '__main__':
+    unittest.main()
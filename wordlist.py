@@ -0,0 +1,243 @@
+#!/usr/bin/python
+
+# Wordlist recovery of a keychain password, for keychains you are authorized to
+# open.
+#
+# Candidates are streamed from the wordlist in chunks to a pool of worker
+# processes. For each candidate a worker derives the master key with PBKDF2 and
+# checks the padding of the last DBBlob block under it. As about one wrong key in
+# 256 also passes that check, each hit is confirmed in the parent process by
+# unlocking the keychain with it, and the search stops at the first one that
+# works.
+#
+# Progress can be checkpointed to a state file, so an interrupted run can be
+# resumed where it stopped. The state file records the keychain it was made for
+# and is refused for any other.
+
+from binascii import hexlify
+from collections import deque
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from chainbreaker import Chainbreaker
+
+# Per process state of the workers, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(backend, salt, chain, block):
+    # Ctrl-C is handled by the parent, which checkpoints and then stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker.update(backend=backend, salt=salt, chain=chain, block=block)
+
+
+# Runs in the workers. Returns the candidates that pass the padding check, the number of candidates
+# checked, the worker's pid and the time it spent on them.
+def _check_candidates(candidates):
+    start = time.time()
+    backend, salt, chain, block = _worker['backend'], _worker['salt'], _worker['chain'], _worker['block']
+
+    hits = []
+    for password in candidates:
+        master = backend.pbkdf2(password, salt, 1000, Chainbreaker.KEYLEN)
+        if Chainbreaker._has_valid_padding(backend.decrypt(master, chain, block)):
+            hits.append(password)
+
+    return hits, len(candidates), os.getpid(), time.time() - start
+
+
+class WordlistSearch(object):
+    # Candidates handed to a worker at a time
+    CHUNK_SIZE = 64
+
+    STATE_VERSION = 1
+
+    def __init__(self, keychain, wordlist, processes=None, report_interval=5, state_file=None,
+                 checkpoint_interval=60):
+        self.keychain = keychain
+        self.wordlist = wordlist
+        self.processes = processes or multiprocessing.cpu_count()
+        self.report_interval = report_interval
+        self.state_file = state_file
+        self.checkpoint_interval = checkpoint_interval
+
+        self.password = None
+        self.tried = 0
+        self.elapsed = 0
+
+        # Byte offset into the wordlist and number of candidates before it, up to which every candidate has
+        # been checked. Only moves forward over chunks in wordlist order, so it is safe to resume from.
+        self.offset = 0
+        self.index = 0
+
+        # pid -> [candidates checked, seconds spent]
+        self.worker_stats = {}
+
+        self.logger = logging.getLogger('Chainbreaker')
+
+    # Yields (candidates, end offset) for chunks of up to CHUNK_SIZE candidate passwords from the
+    # wordlist, one per line, starting at self.offset.
+    def _read_chunks(self):
+        chunk = []
+        offset = self.offset
+        with open(self.wordlist, 'rb') as wordlist:
+            wordlist.seek(offset)
+            for line in wordlist:
+                offset += len(line)
+
+                password = line.rstrip(b'\r\n')
+                if not password:
+                    continue
+
+                chunk.append(password)
+                if len(chunk) == WordlistSearch.CHUNK_SIZE:
+                    yield chunk, offset
+                    chunk = []
+
+        if chunk:
+            yield chunk, offset
+
+    # Identifies the keychain a state file belongs to
+    def _keychain_state(self):
+        return {
+            'keychain_sha256': hashlib.sha256(self.keychain.kc_buffer).hexdigest(),
+            'salt': hexlify(str(bytearray(self.keychain.dbblob.Salt))),
+            'iv': hexlify(str(bytearray(self.keychain.dbblob.IV))),
+        }
+
+    # Atomically writes the current progress to the state file.
+    def save_checkpoint(self):
+        if not self.state_file:
+            return
+
+        state = self._keychain_state()
+        state.update(version=WordlistSearch.STATE_VERSION, wordlist=os.path.abspath(self.wordlist),
+                     offset=self.offset, index=self.index)
+
+        temp_file = '%s.tmp' % self.state_file
+        with open(temp_file, 'w') as f:
+            json.dump(state, f, indent=4, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        getattr(os, 'replace', os.rename)(temp_file, self.state_file)
+
+    # Continues from the progress saved in the state file. If no wordlist was given the one from the state
+    # file is used. Raises ValueError if the state file can't be read or was written for another keychain or
+    # wordlist.
+    def resume(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except IOError as e:
+            raise ValueError("Unable to read state file %s: %s" % (self.state_file, e.strerror or e))
+
+        if state.get('version') != WordlistSearch.STATE_VERSION:
+            raise ValueError("Unsupported state file version: %s" % state.get('version'))
+
+        for field, value in self._keychain_state().items():
+            if state.get(field) != value:
+                raise ValueError("State file %s was written for a different keychain (%s does not match)" % (
+                    self.state_file, field))
+
+        if self.wordlist is None:
+            self.wordlist = state['wordlist']
+        elif os.path.abspath(self.wordlist) != state['wordlist']:
+            raise ValueError("State file %s was written for wordlist %s" % (self.state_file, state['wordlist']))
+
+        self.offset = state['offset']
+        self.index = state['index']
+        self.logger.info("Resuming wordlist %s after %d candidates" % (self.wordlist, self.index))
+
+    # Unlocks the keychain with password, resetting it if the password turns out to be a false positive.
+    def _confirm(self, password):
+        self.keychain.unlock_password = password
+        if not self.keychain.locked:
+            return True
+
+        self.logger.debug("Wordlist candidate passed the padding check but does not unlock the keychain")
+        self.keychain.unlock_password = None
+        self.keychain.db_key = None
+        return False
+
+    def _report(self):
+        per_worker = ', '.join('%.1f/s' % (count / busy if busy else 0)
+                               for count, busy in self.worker_stats.values())
+        self.logger.info("Wordlist: %d candidates tried, %.1f candidates/s total (per worker: %s)" % (
+            self.tried, self.tried / self.elapsed if self.elapsed else 0, per_worker or 'starting'))
+
+    # Checks the wordlist against the keychain. Returns the password and leaves the keychain unlocked with it
+    # if one is found, otherwise returns None.
+    def run(self):
+        tail = self.keychain._get_db_blob_tail()
+        if tail is None:
+            return None
+
+        chain, block = tail
+        salt = str(bytearray(self.keychain.dbblob.Salt))
+        chunks = self._read_chunks()
+
+        pool = multiprocessing.Pool(self.processes, _init_worker,
+                                    (Chainbreaker.get_crypto_backend(), salt, chain, block))
+        pending = deque()
+        start = last_report = last_checkpoint = time.time()
+
+        try:
+            while True:
+                # Keep every worker busy without reading the whole wordlist ahead of them
+                while len(pending) < 2 * self.processes:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    candidates, end = chunk
+                    pending.append((pool.apply_async(_check_candidates, (candidates,)), end))
+
+                if not pending:
+                    break
+
+                result, end = pending[0]
+                result.wait(max(0, last_report + self.report_interval - time.time()))
+                if result.ready():
+                    pending.popleft()
+                    hits, count, pid, busy = result.get()
+
+                    stats = self.worker_stats.setdefault(pid, [0, 0])
+                    stats[0] += count
+                    stats[1] += busy
+                    self.tried += count
+
+                    for password in hits:
+                        if self._confirm(password):
+                            self.password = password
+                            break
+
+                    # Chunks are collected in wordlist order, so everything before end has been checked. The
+                    # chunk the password was found in is not counted, so resuming checks it, and finds it, again.
+                    if self.password is None:
+                        self.offset = end
+                        self.index += count
+
+                self.elapsed = time.time() - start
+                if self.password is not None:
+                    break
+
+                if time.time() - last_report >= self.report_interval:
+                    self._report()
+                    last_report = time.time()
+
+                if time.time() - last_checkpoint >= self.checkpoint_interval:
+                    self.save_checkpoint()
+                    last_checkpoint = time.time()
+        finally:
+            self.save_checkpoint()
+            pool.terminate()
+            pool.join()
+
+        self.elapsed = time.time() - start
+        self._report()
+
+        return self.password